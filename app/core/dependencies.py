@@ -1,26 +1,22 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.core.security import (
-    is_auth, has_role, has_any_role, is_name_in,
-    get_user_id_from_token, get_name_from_token, get_role_from_token
-)
+from app.core.security import get_token_payload
 from typing import Optional, List
+import sys
 
 security = HTTPBearer()
 
 
-def get_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+async def get_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """Extract token from Authorization header"""
     return credentials.credentials
 
 
-def require_auth(token: str = Depends(get_token)) -> dict:
+async def require_auth(token: str = Depends(get_token)) -> dict:
     """
     Dependency to require valid authentication.
     Returns token payload if valid, raises 401 if not.
     """
-    from app.core.security import get_token_payload
-    
     payload = get_token_payload(token)
     if not payload:
         raise HTTPException(
@@ -36,13 +32,16 @@ def require_role(required_role: str):
     Dependency factory to require a specific role.
     Usage: @router.get("/admin", dependencies=[Depends(require_role("admin"))])
     """
-    def role_checker(token: str = Depends(get_token)) -> dict:
-        payload = require_auth(token)
+    # Intern the role so the per-request comparison is usually a pointer check
+    required_role = sys.intern(required_role)
+    error_prefix = f"Required role: {required_role}, but user has role: "
+    
+    async def role_checker(payload: dict = Depends(require_auth)) -> dict:
         user_role = payload.get("role", "")
         if user_role != required_role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Required role: {required_role}, but user has role: {user_role}"
+                detail=error_prefix + str(user_role)
             )
         return payload
     return role_checker
@@ -53,13 +52,16 @@ def require_any_role(required_roles: List[str]):
     Dependency factory to require any of the specified roles.
     Usage: @router.get("/endpoint", dependencies=[Depends(require_any_role(["admin", "teacher"]))])
     """
-    def role_checker(token: str = Depends(get_token)) -> dict:
-        payload = require_auth(token)
+    # Build the lookup set and error prefix once, not on every request
+    required_roles_set = frozenset(required_roles)
+    error_prefix = f"Required one of roles: {list(required_roles)}, but user has role: "
+    
+    async def role_checker(payload: dict = Depends(require_auth)) -> dict:
         user_role = payload.get("role", "")
-        if user_role not in required_roles:
+        if user_role not in required_roles_set:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Required one of roles: {required_roles}, but user has role: {user_role}"
+                detail=error_prefix + str(user_role)
             )
         return payload
     return role_checker
@@ -70,10 +72,11 @@ def require_name_in(allowed_names: List[str]):
     Dependency factory to require user's name to be in the allowed list.
     Usage: @router.get("/endpoint", dependencies=[Depends(require_name_in(["ahmedou", "admin"]))])
     """
-    def name_checker(token: str = Depends(get_token)) -> dict:
-        payload = require_auth(token)
+    allowed_names_set = frozenset(allowed_names)
+    
+    async def name_checker(payload: dict = Depends(require_auth)) -> dict:
         user_name = payload.get("name", "")
-        if user_name not in allowed_names:
+        if user_name not in allowed_names_set:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Access denied for user: {user_name}"
@@ -82,9 +85,9 @@ def require_name_in(allowed_names: List[str]):
     return name_checker
 
 
-def get_current_user_id(token: str = Depends(get_token)) -> str:
+async def get_current_user_id(payload: dict = Depends(require_auth)) -> str:
     """Get current user ID from token"""
-    user_id = get_user_id_from_token(token)
+    user_id = payload.get("sub")
     if not user_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -94,9 +97,9 @@ def get_current_user_id(token: str = Depends(get_token)) -> str:
     return user_id
 
 
-def get_current_user_name(token: str = Depends(get_token)) -> str:
+async def get_current_user_name(payload: dict = Depends(require_auth)) -> str:
     """Get current user name from token"""
-    name = get_name_from_token(token)
+    name = payload.get("name")
     if not name:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -106,9 +109,9 @@ def get_current_user_name(token: str = Depends(get_token)) -> str:
     return name
 
 
-def get_current_user_role(token: str = Depends(get_token)) -> str:
+async def get_current_user_role(payload: dict = Depends(require_auth)) -> str:
     """Get current user role from token"""
-    role = get_role_from_token(token)
+    role = payload.get("role")
     if not role:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,54 @@
+from fastapi import HTTPException, status
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class MaxBodySizeMiddleware:
+    """
+    Reject request bodies larger than max_body_size with 413.
+    Checks Content-Length before anything is read, and counts the bytes
+    actually received (chunked uploads, lying headers) while streaming,
+    so an oversized upload is never spooled in full.
+    """
+    
+    def __init__(self, app: ASGIApp, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+    
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request body exceeds the maximum size of {self.max_body_size} bytes"
+        )
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    break
+                if content_length > self.max_body_size:
+                    error = self._too_large()
+                    response = ORJSONResponse({"detail": error.detail}, status_code=error.status_code)
+                    await response(scope, receive, send)
+                    return
+                break
+        
+        received = 0
+        
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Raised inside the app, turned into a 413 by FastAPI's exception handling
+                    raise self._too_large()
+            return message
+        
+        await self.app(scope, limited_receive, send)
@@ -1,10 +1,34 @@
 import bcrypt
-from jose import JWTError, jwt
+import jwt
+from jwt import InvalidTokenError as JWTError
 from datetime import datetime, timedelta
 from typing import Optional
-import secrets
+from cachetools import TTLCache
+from fastapi.concurrency import run_in_threadpool
+import base64
+import hashlib
+import os
+import threading
+import time
 from app.core.config import settings
 
+# Cache of decoded access tokens, keyed by a digest of the token string.
+# Entries never outlive the token itself (see decode_access_token).
+_JWT_CACHE_TTL = min(60, settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+_JWT_CACHE = TTLCache(maxsize=10_000, ttl=_JWT_CACHE_TTL)
+_JWT_CACHE_LOCK = threading.RLock()
+
+# Random bytes per generated token (same size as secrets.token_urlsafe(32))
+_TOKEN_BYTES = 32
+
+# Lifetimes of the tokens stored in the database
+_VERIFICATION_TOKEN_LIFETIME = timedelta(hours=24)
+_REFRESH_TOKEN_LIFETIME = timedelta(days=settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS)
+_RESET_PASSWORD_TOKEN_LIFETIME = timedelta(hours=1)
+
+# bcrypt cost factor for new hashes (existing hashes keep their own cost)
+_BCRYPT_ROUNDS = settings.BCRYPT_ROUNDS
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
@@ -22,12 +46,22 @@ def get_password_hash(password: str) -> str:
     if isinstance(password, str):
         password = password.encode('utf-8')
     # Generate salt and hash password
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=_BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password, salt)
     # Return as string
     return hashed.decode('utf-8')
 
 
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password in a worker thread so the event loop isn't blocked"""
+    return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
+
+async def aget_password_hash(password: str) -> str:
+    """Hash a password in a worker thread so the event loop isn't blocked"""
+    return await run_in_threadpool(get_password_hash, password)
+
+
 def create_access_token(user_id: str, name: str, role: str, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token with user_id, name, and role"""
     to_encode = {
@@ -35,11 +69,12 @@ def create_access_token(user_id: str, name: str, role: str, expires_delta: Optio
         "name": name,
         "role": role
     }
-    now = datetime.utcnow()
+    # JWT stores iat/exp as epoch seconds, so work with ints directly
+    now = int(time.time())
     if expires_delta:
-        expire = now + expires_delta
+        expire = now + int(expires_delta.total_seconds())
     else:
-        expire = now + timedelta(minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = now + settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES * 60
     
     to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
@@ -48,43 +83,68 @@ def create_access_token(user_id: str, name: str, role: str, expires_delta: Optio
 
 def extract_name_from_email(email: str) -> str:
     """Extract name from email (part before @supnum.mr)"""
-    if "@supnum.mr" in email:
-        return email.split("@supnum.mr")[0]
-    return email.split("@")[0] if "@" in email else email
+    # Single pass; validated emails contain exactly one "@"
+    local, sep, _ = email.partition("@")
+    return local if sep else email
 
 
 def decode_access_token(token: str) -> Optional[dict]:
-    """Decode and verify a JWT token"""
+    """Decode and verify a JWT token (valid payloads are cached until they expire)"""
+    key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    now = time.time()
+    
+    with _JWT_CACHE_LOCK:
+        cached = _JWT_CACHE.get(key)
+    if cached is not None:
+        payload, valid_until = cached
+        if now < valid_until:
+            return payload
+    
     try:
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        return payload
     except JWTError:
+        # Invalid tokens are not cached so garbage input can't fill the cache
         return None
+    
+    # Never serve a cached payload past the token's own expiration
+    valid_until = now + _JWT_CACHE_TTL
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        valid_until = min(valid_until, exp)
+    
+    with _JWT_CACHE_LOCK:
+        _JWT_CACHE[key] = (payload, valid_until)
+    return payload
+
+
+def _token(n_bytes: int = _TOKEN_BYTES) -> str:
+    """Generate a URL-safe random token (equivalent to secrets.token_urlsafe)"""
+    return base64.urlsafe_b64encode(os.urandom(n_bytes)).rstrip(b"=").decode("ascii")
 
 
 def generate_verification_token() -> str:
     """Generate a secure random token for email verification"""
-    return secrets.token_urlsafe(32)
+    return _token()
 
 
 def get_token_expiration() -> datetime:
     """Get token expiration time (24 hours from now)"""
-    return datetime.utcnow() + timedelta(hours=24)
+    return datetime.utcnow() + _VERIFICATION_TOKEN_LIFETIME
 
 
 def generate_refresh_token() -> str:
     """Generate a secure random refresh token"""
-    return secrets.token_urlsafe(32)
+    return _token()
 
 
 def get_refresh_token_expiration() -> datetime:
     """Get refresh token expiration time (7 days from now)"""
-    return datetime.utcnow() + timedelta(days=settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS)
+    return datetime.utcnow() + _REFRESH_TOKEN_LIFETIME
 
 
 def get_reset_password_token_expiration() -> datetime:
     """Get reset password token expiration time (1 hour from now)"""
-    return datetime.utcnow() + timedelta(hours=1)
+    return datetime.utcnow() + _RESET_PASSWORD_TOKEN_LIFETIME
 
 
 def is_auth(token: str) -> bool:
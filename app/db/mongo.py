@@ -1,12 +1,30 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
-from app.core.config import settings
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.errors import ConnectionFailure, PyMongoError
+from app.core.config import settings, SEMESTERS
+
+# Keep a warm connection pool, fail fast on server selection and compress
+# wire traffic (zlib is the fallback if the server doesn't support zstd).
+_CLIENT_OPTIONS = dict(
+    maxPoolSize=100,
+    minPoolSize=10,
+    serverSelectionTimeoutMS=2000,
+    connectTimeoutMS=2000,
+    socketTimeoutMS=5000,
+    compressors="zstd,zlib",
+    retryWrites=True,
+    uuidRepresentation="standard"
+)
 
 # Create MongoDB client
-client = MongoClient(settings.MONGODB_URL)
+client = MongoClient(settings.MONGODB_URL, **_CLIENT_OPTIONS)
+
+# Asyncio client, shared by the whole process, for reads awaited
+# directly on the event loop
+async_client = AsyncMongoClient(settings.MONGODB_URL, **_CLIENT_OPTIONS)
 
 # Get database
 db = client[settings.DATABASE_NAME]
+async_db = async_client[settings.DATABASE_NAME]
 
 # Test connection
 def test_connection():
@@ -21,11 +39,63 @@ def test_connection():
 
 # Get users collection
 users_collection = db.users
+async_users_collection = async_db.users
 
 # Get refresh tokens collection
 refresh_tokens_collection = db.refresh_tokens
+async_refresh_tokens_collection = async_db.refresh_tokens
 
 # Get notes collection
 notes_collection = db.notes
+async_notes_collection = async_db.notes
 # Note: _id is automatically unique in MongoDB, and we use matricule as _id
 
+
+def _create_index(collection, keys, **kwargs) -> bool:
+    """Create one index, logging the failure instead of raising"""
+    try:
+        collection.create_index(keys, **kwargs)
+        return True
+    except PyMongoError as e:
+        print(f"MongoDB index creation failed on {collection.name} {keys}: {e}")
+        return False
+
+
+# Create indexes used by the services (no-op if they already exist).
+# Each index is created on its own so one failure doesn't skip the others.
+# Returns False if a unique index the services rely on for correctness
+# (users.email, refresh_tokens.token) could not be created.
+def ensure_indexes():
+    # Refresh tokens: looked up by token, purged by MongoDB once expired
+    required = _create_index(refresh_tokens_collection, "token", unique=True)
+    _create_index(refresh_tokens_collection, "expires_at", expireAfterSeconds=0)
+    # Refresh tokens: a user's active tokens are revoked together (only
+    # active tokens are indexed; queries must include revoked: False)
+    _create_index(
+        refresh_tokens_collection,
+        "user_id",
+        name="user_id_active",
+        partialFilterExpression={"revoked": False}
+    )
+    
+    # Users: looked up by email and by verification/reset tokens
+    required = _create_index(users_collection, "email", unique=True) and required
+    _create_index(users_collection, "verification_token")
+    _create_index(users_collection, "reset_password_token", sparse=True)
+    
+    # Notes: filtered by department and by the year stored in each
+    # semester sub-document (S1..S6), alone or together
+    _create_index(notes_collection, "department")
+    for semester in SEMESTERS:
+        _create_index(notes_collection, [(f"{semester}.year", 1), ("department", 1)])
+    
+    # CSV uploads: re-uploads of the same file are detected by content hash
+    _create_index(db.csv_uploads, [("content_hash", 1), ("year", 1)], sparse=True)
+    # CSV uploads: listed newest first and filtered by upload date
+    _create_index(db.csv_uploads, [("uploaded_at", -1)])
+    # CSV uploads: latest upload of a semester and year (duplicate check)
+    _create_index(db.csv_uploads, [("semester", 1), ("year", 1), ("uploaded_at", -1)])
+    
+    if required:
+        print("MongoDB indexes ensured!")
+    return required
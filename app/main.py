@@ -1,40 +1,66 @@
 from fastapi import FastAPI
+import anyio.to_thread
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.routes import auth, students
-from app.db.mongo import test_connection
+from app.db.mongo import test_connection, ensure_indexes, async_client
 from app.core.config import settings
+from app.core.middleware import MaxBodySizeMiddleware
+from app.services.email_service import EmailService
 
 app = FastAPI(
     title="User Authentication API",
     description="API for user authentication with JWT",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # orjson is much faster than stdlib json
 )
 
+# Allowed origins, deduplicated (FRONTEND_* usually repeat the defaults below)
+ALLOWED_ORIGINS = tuple(dict.fromkeys([
+    settings.FRONTEND_URL,
+    settings.FRONTEND_VITE_URL,
+    "http://localhost:5173",  # Vite default port
+    "http://localhost:3000",  # React default port
+    "http://127.0.0.1:5173",
+    "http://127.0.0.1:3000",
+]))
+
+# Reject oversized uploads before they are read (413). Added before CORS
+# so that CORSMiddleware (added last, hence outermost) wraps the 413 too.
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=settings.MAX_UPLOAD_SIZE_BYTES)
+
 # CORS Middleware - Required for HttpOnly cookies to work with frontend
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        settings.FRONTEND_URL,
-        settings.FRONTEND_VITE_URL,
-        "http://localhost:5173",  # Vite default port
-        "http://localhost:3000",  # React default port
-        "http://127.0.0.1:5173",
-        "http://127.0.0.1:3000",
-    ],
+    allow_origins=list(ALLOWED_ORIGINS),
     allow_credentials=True,  # Required for cookies
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
     expose_headers=["*"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
 # Include routers
 app.include_router(auth.router)
 app.include_router(students.router)
 
-# Test MongoDB connection on startup
+# All blocking work (DB, CSV, bcrypt, rank computation) goes through
+# run_in_threadpool, i.e. AnyIO's worker threads (default limit is 40)
+THREADPOOL_SIZE = 100
+
+# Test MongoDB connection and ensure indexes on startup
 @app.on_event("startup")
 async def startup_event():
-    test_connection()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    if test_connection() and not ensure_indexes():
+        # Without the unique indexes, duplicate users or refresh tokens could be stored
+        raise RuntimeError("Required MongoDB unique indexes could not be created")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await async_client.close()
+    EmailService.close()
 
 
 @app.get("/")
@@ -1,38 +1,31 @@
-from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+from datetime import datetime
 from typing import Optional
 from bson import ObjectId
 
 
+@dataclass(slots=True)
 class User:
-    def __init__(
-        self,
-        email: str,
-        password: str,
-        role: str = "student",
-        email_verified: bool = False,
-        verification_token: Optional[str] = None,
-        token_expires_at: Optional[datetime] = None,
-        token_used: bool = False,
-        reset_password_token: Optional[str] = None,
-        reset_password_expires_at: Optional[datetime] = None,
-        is_active: bool = True,
-        created_at: Optional[datetime] = None,
-        updated_at: Optional[datetime] = None,
-        _id: Optional[ObjectId] = None
-    ):
-        self._id = _id
-        self.email = email
-        self.password = password
-        self.role = role
-        self.email_verified = email_verified
-        self.verification_token = verification_token
-        self.token_expires_at = token_expires_at
-        self.token_used = token_used
-        self.reset_password_token = reset_password_token
-        self.reset_password_expires_at = reset_password_expires_at
-        self.is_active = is_active
-        self.created_at = created_at or datetime.utcnow()
-        self.updated_at = updated_at or datetime.utcnow()
+    email: str
+    password: str = field(repr=False)
+    role: str = "student"
+    email_verified: bool = False
+    verification_token: Optional[str] = None
+    token_expires_at: Optional[datetime] = None
+    token_used: bool = False
+    reset_password_token: Optional[str] = None
+    reset_password_expires_at: Optional[datetime] = None
+    is_active: bool = True
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    _id: Optional[ObjectId] = None
+    
+    def __post_init__(self):
+        now = datetime.utcnow()
+        if self.created_at is None:
+            self.created_at = now
+        if self.updated_at is None:
+            self.updated_at = now
     
     def to_dict(self):
         """Convert user to dictionary for MongoDB"""
@@ -57,6 +50,5 @@ class User:
     @classmethod
     def from_dict(cls, user_dict: dict):
         """Create user from dictionary"""
-        user_dict.pop("_id", None)
-        return cls(**user_dict)
+        return cls(**{k: v for k, v in user_dict.items() if k != "_id"})
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Response, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.schemas.user import (
     UserCreate, UserLogin, UserResponse, TokenResponse,
@@ -11,16 +11,37 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 security = HTTPBearer()
 
 
+def _set_refresh_cookie(
+    response: Response,
+    refresh_token: str,
+    key: str = settings.REFRESH_TOKEN_COOKIE_NAME,
+    max_age: int = settings.REFRESH_TOKEN_MAX_AGE_SECONDS,
+    httponly: bool = settings.REFRESH_TOKEN_COOKIE_HTTP_ONLY,
+    secure: bool = settings.REFRESH_TOKEN_COOKIE_SECURE,
+    samesite: str = settings.REFRESH_TOKEN_COOKIE_SAME_SITE
+) -> None:
+    """Set refresh token in HttpOnly Secure cookie (cookie settings are bound once at import)"""
+    response.set_cookie(
+        key=key,
+        value=refresh_token,
+        max_age=max_age,
+        httponly=httponly,
+        secure=secure,
+        samesite=samesite,
+        path="/"
+    )
+
+
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, background_tasks: BackgroundTasks):
     """Register a new user - only email (@supnum.mr) and password required"""
-    return AuthService.register_user(user_data)
+    return await AuthService.register_user(user_data, background_tasks)
 
 
 @router.get("/verify-email")
 async def verify_email(token: str = Query(..., description="Verification token from email")):
     """Verify user email using token from verification email"""
-    return AuthService.verify_email(token)
+    return await AuthService.verify_email(token)
 
 
 @router.post("/login", response_model=TokenResponse)
@@ -30,21 +51,11 @@ async def login(login_data: UserLogin, response: Response):
     Access token should be stored in memory (RAM) only, not in localStorage or cookie.
     Only works if email is verified.
     """
-    result = AuthService.authenticate_user(login_data)
+    result = await AuthService.authenticate_user(login_data)
     
     # Set refresh token in HttpOnly Secure cookie
     refresh_token = result.pop("refresh_token")  # Remove from response body
-    max_age = settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60  # Convert days to seconds
-    
-    response.set_cookie(
-        key=settings.REFRESH_TOKEN_COOKIE_NAME,
-        value=refresh_token,
-        max_age=max_age,
-        httponly=settings.REFRESH_TOKEN_COOKIE_HTTP_ONLY,
-        secure=settings.REFRESH_TOKEN_COOKIE_SECURE,
-        samesite=settings.REFRESH_TOKEN_COOKIE_SAME_SITE,
-        path="/"
-    )
+    _set_refresh_cookie(response, refresh_token)
     
     return result
 
@@ -65,7 +76,7 @@ async def refresh_token(request: Request):
             detail="Refresh token not found in cookie"
         )
     
-    return AuthService.refresh_access_token(refresh_token)
+    return await AuthService.refresh_access_token(refresh_token)
 
 
 @router.post("/logout")
@@ -79,7 +90,7 @@ async def logout(request: Request, response: Response):
     
     if refresh_token:
         # Revoke token in database
-        AuthService.revoke_refresh_token(refresh_token)
+        await AuthService.revoke_refresh_token(refresh_token)
     
     # Delete cookie
     response.delete_cookie(
@@ -92,12 +103,12 @@ async def logout(request: Request, response: Response):
 
 
 @router.post("/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
+async def forgot_password(request: ForgotPasswordRequest, background_tasks: BackgroundTasks):
     """
     Request password reset. Always returns success message for security reasons.
     Only sends email if account exists, is active, and email is verified.
     """
-    return AuthService.forgot_password(request.email)
+    return await AuthService.forgot_password(request.email, background_tasks)
 
 
 @router.post("/reset-password")
@@ -106,12 +117,12 @@ async def reset_password(request: ResetPasswordRequest):
     Reset password using token from email.
     Requires token and new password.
     """
-    return AuthService.reset_password(request.token, request.new_password)
+    return await AuthService.reset_password(request.token, request.new_password)
 
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current authenticated user - reads name and role from access token"""
     token = credentials.credentials
-    return AuthService.get_current_user(token)
+    return await AuthService.get_current_user(token)
 
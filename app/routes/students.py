@@ -1,32 +1,150 @@
-from fastapi import APIRouter, UploadFile, File, Query, HTTPException, status, Depends
+from fastapi import APIRouter, UploadFile, File, Query, Header, HTTPException, Request, Response, status, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from app.services.csv_service import CSVService
 from app.services.note_service import NoteService
 from app.services.upload_service import (
-    save_csv_file, save_upload_info, get_user_email,
+    process_and_save_csv_file, save_upload_info, get_user_email,
+    compute_content_hash, find_duplicate_upload,
     get_all_uploads, get_uploads_by_date_range, get_upload_by_id, delete_upload,
-    get_dashboard_stats
+    get_dashboard_stats, clear_uploads_cache
 )
+from app.core.config import SEMESTERS
 from app.core.dependencies import (
     get_current_user_id, get_current_user_name, require_role, require_auth, get_token
 )
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Iterable
 from datetime import datetime
-import re
+import codecs
+import hashlib
+import orjson
 
-router = APIRouter(prefix="/students", tags=["Students"])
+router = APIRouter(
+    prefix="/students",
+    tags=["Students"],
+    default_response_class=ORJSONResponse
+)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Content types browsers and HTTP clients send for .csv files
+ALLOWED_CSV_CONTENT_TYPES = frozenset({
+    "text/csv",
+    "application/csv",
+    "text/x-csv",
+    "application/vnd.ms-excel",
+    "text/plain",
+    "application/octet-stream",
+})
+# Bytes inspected at the start of an upload before it is parsed
+CSV_SNIFF_SIZE = 4096
+
+# Semester codes a student can change the visibility of
+VALID_SEMESTERS = frozenset(SEMESTERS)
+
+# Read endpoints are always revalidated with the ETag before reuse, so a
+# visibility change or new upload is seen on the next request
+READ_CACHE_CONTROL = "private, no-cache"
 
 
 def validate_year_format(year: str) -> bool:
     """Validate year format: YYYY-YYYY"""
-    pattern = r'^\d{4}-\d{4}$'
-    return bool(re.match(pattern, year))
+    # Plain string checks run in C, no regex engine needed on every request
+    return (
+        len(year) == 9
+        and year[4] == "-"
+        and year.isascii()
+        and year[:4].isdigit()
+        and year[5:].isdigit()
+    )
+
+
+def parse_iso_datetime(value: str, end_of_day: bool = False) -> datetime:
+    """
+    Parse an ISO date (YYYY-MM-DD) or datetime; raises ValueError otherwise.
+    With end_of_day, a date-only value is moved to the end of that day.
+    """
+    # fromisoformat only accepts 'Z' from Python 3.11
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed
+
+
+def validate_csv_upload(file: UploadFile) -> None:
+    """
+    Check that an upload looks like a CSV file before any parsing or storage.
+    Raises 400 for a wrong extension or content, 415 for a wrong content type.
+    """
+    if not file.filename or not file.filename.lower().endswith('.csv'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be a CSV file"
+        )
+    
+    content_type = (file.content_type or "").split(";", 1)[0].strip().lower()
+    if content_type and content_type not in ALLOWED_CSV_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content type: {content_type}"
+        )
+    
+    # The head must be UTF-8 text (as the parser expects) with a comma-separated first line
+    file.file.seek(0)
+    head = file.file.read(CSV_SNIFF_SIZE)
+    file.file.seek(0)
+    try:
+        text = codecs.getincrementaldecoder("utf-8-sig")().decode(head, final=False)
+    except UnicodeDecodeError:
+        text = None
+    if not text or "," not in text.partition("\n")[0]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File content is not a valid CSV file"
+        )
+
+
+def _cacheable_response(request: Request, content: Any) -> Response:
+    """
+    Serialize content and answer with an ETag (hash of the body).
+    Returns 304 Not Modified if the client already has this version.
+    The data is still read (usually from NoteService's cache) and serialized
+    to compute the ETag, so a 304 only saves the transfer; a validator kept
+    in process memory could not see writes made by another worker.
+    """
+    body = orjson.dumps(content, option=_ORJSON_OPTIONS)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": READ_CACHE_CONTROL}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in client_etags or "*" in client_etags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def _stream_students_ndjson(
+    header: Dict[str, Any],
+    students: Iterable[Dict[str, Any]]
+) -> AsyncIterator[bytes]:
+    """Yield a header line, then one JSON line per student (NDJSON)"""
+    yield orjson.dumps(header, option=_ORJSON_OPTIONS) + b"\n"
+    for student in students:
+        yield orjson.dumps(student, option=_ORJSON_OPTIONS) + b"\n"
 
 
 @router.post("/upload-csv", dependencies=[Depends(require_role("admin"))])
 async def upload_csv(
     file: UploadFile = File(..., description="CSV file to upload"),
     year: str = Query(..., description="Year in format YYYY-YYYY (e.g., 2024-2025)"),
-    current_user_id: str = Depends(get_current_user_id)
+    return_students: bool = Query(True, description="Include the parsed students in the response"),
+    current_user_id: str = Depends(get_current_user_id),
+    accept: Optional[str] = Header(None)
 ) -> Dict[str, Any]:
     """
     Upload and process a CSV file containing student grades.
@@ -36,17 +154,18 @@ async def upload_csv(
     Args:
         file: CSV file to upload
         year: Year string in format "YYYY-YYYY" (e.g., "2024-2025")
+        return_students: If false, only the semester and students count are
+                         returned (student data isn't extracted at all)
         current_user_id: Current authenticated user ID (from token)
+        accept: When it includes "application/x-ndjson", the response is
+                streamed as NDJSON: a header line (message, year, semester,
+                students_count) followed by one line per student
     
     Returns:
         Dictionary containing processed student data (without saving)
     """
-    # Validate file type
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File must be a CSV file"
-        )
+    # Validate file type (extension, content type and content)
+    validate_csv_upload(file)
     
     # Validate year format
     if not validate_year_format(year):
@@ -56,13 +175,37 @@ async def upload_csv(
         )
     
     try:
-        # Read file content
-        file_content = await file.read()
+        # Parse straight from the spooled upload instead of reading it into memory
+        # Parsing is CPU-bound, keep it off the event loop
+        file.file.seek(0)
+        if not return_students:
+            students_count, semester = await run_in_threadpool(
+                CSVService.count_students, file.file
+            )
+            return {
+                "message": "CSV file processed successfully",
+                "year": year,
+                "semester": semester,
+                "students_count": students_count
+            }
         
-        # Process CSV file
-        students_data, semester = CSVService.process_csv_file(file_content, year)
+        students_data, semester = await run_in_threadpool(
+            CSVService.process_csv_file, file.file, year
+        )
         students_count = len(students_data)
         
+        if accept and NDJSON_MEDIA_TYPE in accept:
+            header = {
+                "message": "CSV file processed successfully",
+                "year": year,
+                "semester": semester,
+                "students_count": students_count
+            }
+            return StreamingResponse(
+                _stream_students_ndjson(header, students_data.values()),
+                media_type=NDJSON_MEDIA_TYPE
+            )
+        
         return {
             "message": "CSV file processed successfully",
             "year": year,
@@ -91,6 +234,8 @@ async def save_notes(
     Processes the file, saves it to disk, stores upload info, and saves notes.
     Each document uses 'matricule' as the unique identifier.
     Performs upsert operation (create if not exists, update if exists).
+    A file identical to one already saved for the same year (and whose
+    notes are still stored) is not processed again.
     
     Args:
         file: CSV file to save
@@ -100,12 +245,8 @@ async def save_notes(
     Returns:
         Dictionary with operation results including upload info
     """
-    # Validate file type
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File must be a CSV file"
-        )
+    # Validate file type (extension, content type and content)
+    validate_csv_upload(file)
     
     # Validate year format
     if not validate_year_format(year):
@@ -115,29 +256,53 @@ async def save_notes(
         )
     
     try:
-        # Read file content
-        file_content = await file.read()
-        file_size = len(file_content)
+        # The upload is already spooled to a temporary file by the server;
+        # use it directly instead of reading the whole content into memory
+        file_size = file.size
         
         # Get user email
-        user_email = get_user_email(current_user_id)
+        user_email = await run_in_threadpool(get_user_email, current_user_id)
         if not user_email:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        # Process CSV file FIRST (before saving to disk)
-        # This ensures we only save valid files
-        students_data, semester = CSVService.process_csv_file(file_content, year)
-        students_count = len(students_data)
+        # Skip everything if this exact file was already saved for this year
+        file.file.seek(0)
+        content_hash = await run_in_threadpool(compute_content_hash, file.file)
+        duplicate = await run_in_threadpool(find_duplicate_upload, content_hash, year)
+        if duplicate:
+            return {
+                "message": "This file was already saved, notes are up to date",
+                "duplicate": True,
+                "year": year,
+                "semester": duplicate["semester"],
+                "students_count": duplicate["students_count"],
+                "upload_info": {
+                    "filename": duplicate["filename"],
+                    "saved_path": duplicate["saved_path"],
+                    "uploaded_by": str(duplicate["uploaded_by"]),
+                    "uploaded_by_email": duplicate["uploaded_by_email"],
+                    "uploaded_at": duplicate["uploaded_at"],
+                    "year": duplicate["year"],
+                    "semester": duplicate["semester"],
+                    "file_size": duplicate["file_size"]
+                },
+                "notes_results": None
+            }
         
-        # Save file to disk
-        saved_path = save_csv_file(file_content, file.filename)
+        # Parse the CSV and save it to storage in the same pass
+        # (the saved file is removed again if parsing fails)
+        students_data, semester, saved_path = await run_in_threadpool(
+            process_and_save_csv_file, file.file, file.filename, year
+        )
+        students_count = len(students_data)
         
         try:
             # Save upload information to database
-            upload_info = save_upload_info(
+            upload_info = await run_in_threadpool(
+                save_upload_info,
                 filename=file.filename,
                 saved_path=saved_path,
                 uploaded_by=current_user_id,
@@ -145,12 +310,13 @@ async def save_notes(
                 year=year,
                 semester=semester,
                 students_count=students_count,
-                file_size=file_size
+                file_size=file_size,
+                content_hash=content_hash
             )
         except Exception as db_error:
             # If database save fails, delete the file to prevent orphaned files
             from app.services.upload_service import delete_csv_file
-            delete_csv_file(saved_path)
+            await run_in_threadpool(delete_csv_file, saved_path)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Error saving upload information: {str(db_error)}"
@@ -158,7 +324,11 @@ async def save_notes(
         
         # Save student notes
         try:
-            notes_result = NoteService.save_multiple_students_notes(students_data)
+            notes_result = await run_in_threadpool(
+                NoteService.save_multiple_students_notes, students_data
+            )
+            # Dashboard student count changed
+            clear_uploads_cache()
         except Exception as notes_error:
             # If notes save fails, we still keep the file and upload info
             # but report the error
@@ -177,7 +347,7 @@ async def save_notes(
                 "saved_path": upload_info["saved_path"],
                 "uploaded_by": str(upload_info["uploaded_by"]),
                 "uploaded_by_email": upload_info["uploaded_by_email"],
-                "uploaded_at": upload_info["uploaded_at"].isoformat(),
+                "uploaded_at": upload_info["uploaded_at"],
                 "year": upload_info["year"],
                 "semester": upload_info["semester"],
                 "file_size": upload_info["file_size"]
@@ -196,10 +366,12 @@ async def save_notes(
 
 @router.get("/notes", dependencies=[Depends(require_role("admin"))])
 async def get_all_notes(
+    request: Request,
     semester: str = Query(None, description="Filter by semester (e.g., S3)"),
     department: str = Query(None, description="Filter by department"),
     year: str = Query(None, description="Filter by year in format YYYY-YYYY (e.g., 2024-2025)"),
-    current_user_id: str = Depends(get_current_user_id)
+    current_user_id: str = Depends(get_current_user_id),
+    accept: Optional[str] = Header(None)
 ) -> Dict[str, Any]:
     """
     Get student notes from MongoDB with optional filters.
@@ -210,7 +382,9 @@ async def get_all_notes(
         year: Filter by year in format "YYYY-YYYY" (e.g., "2024-2025")
     
     Returns:
-        Dictionary containing total count and list of filtered student notes documents
+        Dictionary containing total count and list of filtered student notes documents.
+        With "Accept: application/x-ndjson", the total and filters come as a first
+        JSON line followed by one line per student, without building the whole body.
     """
     try:
         # Validate year format if provided
@@ -222,23 +396,31 @@ async def get_all_notes(
         
         # Get filtered notes
         if semester is not None or department is not None or year is not None:
-            notes = NoteService.get_filtered_notes(
+            notes = await NoteService.get_filtered_notes(
                 semester=semester,
                 department=department,
                 year=year
             )
         else:
-            notes = NoteService.get_all_notes()
+            notes = await NoteService.get_all_notes()
         
-        return {
+        filters = {
+            "semester": semester,
+            "department": department,
+            "year": year
+        }
+        
+        if accept and NDJSON_MEDIA_TYPE in accept:
+            return StreamingResponse(
+                _stream_students_ndjson({"total": len(notes), "filters": filters}, notes),
+                media_type=NDJSON_MEDIA_TYPE
+            )
+        
+        return _cacheable_response(request, {
             "total": len(notes),
-            "filters": {
-                "semester": semester,
-                "department": department,
-                "year": year
-            },
+            "filters": filters,
             "notes": notes
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -250,6 +432,7 @@ async def get_all_notes(
 
 @router.get("/statistics", dependencies=[Depends(require_role("admin"))])
 async def get_statistics(
+    request: Request,
     semester: str = Query(None, description="Filter by semester (e.g., S3)"),
     department: str = Query(None, description="Filter by department"),
     year: str = Query(None, description="Filter by year in format YYYY-YYYY (e.g., 2024-2025)"),
@@ -283,20 +466,20 @@ async def get_statistics(
                 detail="Year must be in format YYYY-YYYY (e.g., 2024-2025)"
             )
         
-        statistics = NoteService.get_statistics(
+        statistics = await NoteService.get_statistics(
             semester=semester,
             department=department,
             year=year
         )
         
-        return {
+        return _cacheable_response(request, {
             "filters": {
                 "semester": semester,
                 "department": department,
                 "year": year
             },
             **statistics
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -309,6 +492,7 @@ async def get_statistics(
 @router.get("/notes/{matricule}", dependencies=[Depends(require_role("admin"))])
 async def get_student_notes(
     matricule: int,
+    request: Request,
     current_user_id: str = Depends(get_current_user_id)
 ) -> Dict[str, Any]:
     """
@@ -320,18 +504,18 @@ async def get_student_notes(
     Returns:
         Student notes document
     """
-    notes = NoteService.get_student_notes(matricule)
+    notes = await NoteService.get_student_notes(matricule)
     if not notes:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Notes not found for matricule: {matricule}"
         )
-    return notes
+    return _cacheable_response(request, notes)
 
 
 @router.get("/my-notes", dependencies=[Depends(require_auth)])
 async def get_my_notes(
-    token: str = Depends(get_token)
+    name: str = Depends(get_current_user_name)
 ) -> Dict[str, Any]:
     """
     Get current student's notes.
@@ -342,9 +526,6 @@ async def get_my_notes(
         Student notes document with all details including computed fields
     """
     try:
-        # Get name from token (assuming name is matricule)
-        name = get_current_user_name(token)
-        
         # Try to convert name to int (matricule)
         try:
             matricule = int(name)
@@ -355,7 +536,7 @@ async def get_my_notes(
             )
         
         # Get student notes
-        notes = NoteService.get_student_notes(matricule)
+        notes = await NoteService.get_student_notes(matricule)
         
         if not notes:
             raise HTTPException(
@@ -378,7 +559,7 @@ async def get_my_notes(
 async def update_my_semester_ispublic(
     semester: str,
     is_public: bool = Query(..., description="Set isPublic to true or false"),
-    token: str = Depends(get_token)
+    name: str = Depends(get_current_user_name)
 ) -> Dict[str, Any]:
     """
     Update isPublic field for a specific semester of the current student.
@@ -387,15 +568,12 @@ async def update_my_semester_ispublic(
     Args:
         semester: Semester code (e.g., "S3")
         is_public: Boolean value (true or false) for isPublic field
-        token: Authentication token
+        name: Current user name from token (the student's matricule)
     
     Returns:
         Dictionary with operation result
     """
     try:
-        # Get name from token (assuming name is matricule)
-        name = get_current_user_name(token)
-        
         # Try to convert name to int (matricule)
         try:
             matricule = int(name)
@@ -406,19 +584,22 @@ async def update_my_semester_ispublic(
             )
         
         # Validate semester format
-        if not semester.upper().startswith('S') or len(semester) < 2:
+        semester = semester.upper()
+        if semester not in VALID_SEMESTERS:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid semester format. Expected format: S1, S2, S3, etc."
+                detail=f"Invalid semester. Expected one of: {', '.join(SEMESTERS)}"
             )
         
         # Update isPublic
-        result = NoteService.update_semester_ispublic(matricule, semester.upper(), is_public)
+        result = await NoteService.update_semester_ispublic(
+            matricule, semester, is_public
+        )
         
         return {
             "message": f"Semester {semester} visibility updated successfully",
             "matricule": matricule,
-            "semester": semester.upper(),
+            "semester": semester,
             "isPublic": is_public,
             "updated": result["updated"]
         }
@@ -456,7 +637,7 @@ async def get_student_public_notes(
     """
     try:
         # Get student public notes
-        notes = NoteService.get_student_public_notes(matricule)
+        notes = await NoteService.get_student_public_notes(matricule)
         
         if not notes:
             raise HTTPException(
@@ -478,7 +659,7 @@ async def get_student_public_notes(
 @router.patch("/my-notes/ispublic-globale", dependencies=[Depends(require_auth)])
 async def update_my_ispublic_globale(
     is_public_globale: bool = Query(..., description="Set isPublicGlobale to true or false"),
-    token: str = Depends(get_token)
+    name: str = Depends(get_current_user_name)
 ) -> Dict[str, Any]:
     """
     Update isPublicGlobale field for the current student.
@@ -488,15 +669,12 @@ async def update_my_ispublic_globale(
     
     Args:
         is_public_globale: Boolean value (true or false) for isPublicGlobale field
-        token: Authentication token
+        name: Current user name from token (the student's matricule)
     
     Returns:
         Dictionary with operation result
     """
     try:
-        # Get name from token (assuming name is matricule)
-        name = get_current_user_name(token)
-        
         # Try to convert name to int (matricule)
         try:
             matricule = int(name)
@@ -507,7 +685,9 @@ async def update_my_ispublic_globale(
             )
         
         # Update isPublicGlobale
-        result = NoteService.update_ispublic_globale(matricule, is_public_globale)
+        result = await NoteService.update_ispublic_globale(
+            matricule, is_public_globale
+        )
         
         return {
             "message": "Global visibility updated successfully",
@@ -550,28 +730,12 @@ async def get_uploads(
     try:
         if start_date or end_date:
             # Parse dates
-            if start_date:
-                try:
-                    start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                except ValueError:
-                    # Try date only format
-                    start_dt = datetime.fromisoformat(start_date)
-            else:
-                start_dt = datetime.min
-            
-            if end_date:
-                try:
-                    end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                except ValueError:
-                    # Try date only format and set to end of day
-                    end_dt = datetime.fromisoformat(end_date)
-                    end_dt = end_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-            else:
-                end_dt = datetime.utcnow()
+            start_dt = parse_iso_datetime(start_date) if start_date else None
+            end_dt = parse_iso_datetime(end_date, end_of_day=True) if end_date else None
             
-            uploads = get_uploads_by_date_range(start_dt, end_dt)
+            uploads = await get_uploads_by_date_range(start_dt, end_dt)
         else:
-            uploads = get_all_uploads()
+            uploads = await get_all_uploads()
         
         return {
             "total": len(uploads),
@@ -607,7 +771,7 @@ async def get_upload_details(
     Returns:
         Upload document with all details
     """
-    upload = get_upload_by_id(upload_id)
+    upload = await get_upload_by_id(upload_id)
     if not upload:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -635,7 +799,7 @@ async def delete_upload_file(
         Dictionary with deletion results including notes deletion info
     """
     try:
-        result = delete_upload(upload_id)
+        result = await run_in_threadpool(delete_upload, upload_id)
         
         if not result.get("success", False):
             if result.get("message") == "Upload not found":
@@ -684,7 +848,7 @@ async def get_dashboard(
         - recent_uploads: List of recent uploads (last 5)
     """
     try:
-        stats = get_dashboard_stats()
+        stats = await get_dashboard_stats()
         return stats
     except Exception as e:
         raise HTTPException(
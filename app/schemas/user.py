@@ -2,6 +2,9 @@ from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import Optional
 from datetime import datetime
 
+# Only institutional addresses can register
+ALLOWED_EMAIL_DOMAIN = "supnum.mr"
+
 
 class UserCreate(BaseModel):
     email: EmailStr = Field(..., description="Email must end with @supnum.mr")
@@ -10,7 +13,8 @@ class UserCreate(BaseModel):
     @field_validator('email')
     @classmethod
     def validate_email_domain(cls, v: str) -> str:
-        if not v.endswith('@supnum.mr'):
+        # EmailStr has already checked there is exactly one '@'
+        if v.rpartition('@')[2] != ALLOWED_EMAIL_DOMAIN:
             raise ValueError('Email must end with @supnum.mr')
         return v
 
@@ -1,73 +1,113 @@
-from fastapi import HTTPException, status
-from app.db.mongo import users_collection, refresh_tokens_collection
+from fastapi import BackgroundTasks, HTTPException, status
+from app.db.mongo import async_users_collection, async_refresh_tokens_collection
 from app.models.user import User
 from app.schemas.user import UserCreate, UserLogin, UserResponse
 from app.core.security import (
-    verify_password, get_password_hash, create_access_token, decode_access_token,
+    averify_password, aget_password_hash, create_access_token, decode_access_token,
     generate_verification_token, get_token_expiration, extract_name_from_email,
     generate_refresh_token, get_refresh_token_expiration, get_reset_password_token_expiration
 )
 from app.services.email_service import EmailService
 from bson import ObjectId
 from datetime import datetime
+from pymongo import ReturnDocument, WriteConcern
+from pymongo.errors import DuplicateKeyError
+
+# Only the fields UserResponse is built from
+_USER_RESPONSE_PROJECTION = {
+    "email": 1,
+    "role": 1,
+    "email_verified": 1,
+    "is_active": 1,
+    "created_at": 1,
+    "updated_at": 1
+}
+
+# Only the fields login needs (credentials checks + UserResponse)
+_LOGIN_USER_PROJECTION = {**_USER_RESPONSE_PROJECTION, "password": 1}
+
+# Only the fields checked before verifying an email
+_VERIFY_USER_PROJECTION = {"token_used": 1, "token_expires_at": 1, "email_verified": 1}
+
+# Only the fields checked before sending or using a password reset token
+_RESET_USER_PROJECTION = {"is_active": 1, "email_verified": 1, "reset_password_expires_at": 1}
+
+# Token fields and joined user fields needed to refresh an access token
+_REFRESH_TOKEN_PROJECTION = {
+    "user_id": 1,
+    "revoked": 1,
+    "expires_at": 1,
+    "user.email": 1,
+    "user.role": 1,
+    "user.is_active": 1
+}
+
+# Refresh tokens are re-issued on next login if lost, so skip the journal wait
+_refresh_tokens_fast_write = async_refresh_tokens_collection.with_options(
+    write_concern=WriteConcern(w=1, j=False)
+)
+
+# last_used_at is informational only, so don't wait for any acknowledgement
+_refresh_tokens_unacknowledged_write = async_refresh_tokens_collection.with_options(
+    write_concern=WriteConcern(w=0)
+)
 
 
 class AuthService:
     @staticmethod
-    def register_user(user_data: UserCreate) -> dict:
-        """Register a new user or update existing unverified user and send verification email"""
-        # Check if user already exists
-        existing_user = users_collection.find_one({"email": user_data.email})
-        
+    async def register_user(user_data: UserCreate, background_tasks: BackgroundTasks) -> dict:
+        """
+        Register a new user or update existing unverified user and send verification email.
+        The email is sent by background_tasks after the response.
+        """
         # Hash password
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await aget_password_hash(user_data.password)
         
         # Generate verification token
         verification_token = generate_verification_token()
         token_expires_at = get_token_expiration()
         
-        if existing_user:
-            # Check if user is already verified
-            if existing_user.get("email_verified", False):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Email already registered and verified. Please login instead."
-                )
-            
-            # Update existing unverified user
-            users_collection.update_one(
-                {"_id": existing_user["_id"]},
-                {
-                    "$set": {
-                        "password": hashed_password,
-                        "verification_token": verification_token,
-                        "token_expires_at": token_expires_at,
-                        "token_used": False,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
+        # New user document; everything but the credentials below is only
+        # written when the user is created (the email comes from the filter)
+        new_user = User(
+            email=user_data.email,
+            password=hashed_password,
+            role="student",
+            email_verified=False,
+            verification_token=verification_token,
+            token_expires_at=token_expires_at,
+            token_used=False
+        ).to_dict()
+        credentials = {
+            field: new_user.pop(field)
+            for field in ("password", "verification_token", "token_expires_at", "token_used", "updated_at")
+        }
+        del new_user["email"]
+        
+        # Update the unverified user with this email, or create it, in one
+        # atomic step. A verified user doesn't match the filter, so the upsert
+        # hits the unique email index instead (startup fails without that index).
+        try:
+            existing_user = await async_users_collection.find_one_and_update(
+                {"email": user_data.email, "email_verified": {"$ne": True}},
+                {"$set": credentials, "$setOnInsert": new_user},
+                projection={"_id": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
             )
-            
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered and verified. Please login instead."
+            )
+        
+        if existing_user:
             message = "Registration updated. A new verification email has been sent. Please check your email to verify your account."
         else:
-            # Create new user
-            user = User(
-                email=user_data.email,
-                password=hashed_password,
-                role="student",
-                email_verified=False,
-                verification_token=verification_token,
-                token_expires_at=token_expires_at,
-                token_used=False
-            )
-            
-            # Insert into database
-            users_collection.insert_one(user.to_dict())
-            
             message = "Registration successful. Please check your email to verify your account."
         
-        # Send verification email
-        EmailService.send_verification_email(user_data.email, verification_token)
+        # Send verification email once the response has gone out
+        background_tasks.add_task(EmailService.send_verification_email, user_data.email, verification_token)
         
         return {
             "message": message,
@@ -75,10 +115,10 @@ class AuthService:
         }
     
     @staticmethod
-    def verify_email(verification_token: str) -> dict:
+    async def verify_email(verification_token: str) -> dict:
         """Verify user email using verification token (valid for 24 hours, single use)"""
         # Find user by verification token
-        user = users_collection.find_one({"verification_token": verification_token})
+        user = await async_users_collection.find_one({"verification_token": verification_token}, _VERIFY_USER_PROJECTION)
         
         if not user:
             raise HTTPException(
@@ -94,8 +134,9 @@ class AuthService:
             )
         
         # Check if token expired
+        now = datetime.utcnow()
         token_expires_at = user.get("token_expires_at")
-        if token_expires_at and datetime.utcnow() > token_expires_at:
+        if token_expires_at and now > token_expires_at:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Verification token has expired. Please register again to get a new token."
@@ -109,7 +150,7 @@ class AuthService:
             )
         
         # Update user to verified and mark token as used
-        users_collection.update_one(
+        await async_users_collection.update_one(
             {"_id": user["_id"]},
             {
                 "$set": {
@@ -117,7 +158,7 @@ class AuthService:
                     "verification_token": None,
                     "token_expires_at": None,
                     "token_used": True,
-                    "updated_at": datetime.utcnow()
+                    "updated_at": now
                 }
             }
         )
@@ -125,10 +166,10 @@ class AuthService:
         return {"message": "Email verified successfully. You can now login."}
     
     @staticmethod
-    def authenticate_user(login_data: UserLogin) -> dict:
+    async def authenticate_user(login_data: UserLogin) -> dict:
         """Authenticate user and return JWT token"""
         # Find user by email
-        user = users_collection.find_one({"email": login_data.email})
+        user = await async_users_collection.find_one({"email": login_data.email}, _LOGIN_USER_PROJECTION)
         
         if not user:
             raise HTTPException(
@@ -137,7 +178,7 @@ class AuthService:
             )
         
         # Verify password
-        if not verify_password(login_data.password, user["password"]):
+        if not await averify_password(login_data.password, user["password"]):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password"
@@ -160,18 +201,17 @@ class AuthService:
         # Extract name from email
         name = extract_name_from_email(user["email"])
         role = user.get("role", "student")
-        user_id = str(user["_id"])
         
         # Create access token with name and role
-        access_token = create_access_token(user_id=user_id, name=name, role=role)
+        access_token = create_access_token(user_id=str(user["_id"]), name=name, role=role)
         
         # Generate and save refresh token
         refresh_token = generate_refresh_token()
         refresh_token_expires_at = get_refresh_token_expiration()
         
         # Save refresh token to database
-        refresh_tokens_collection.insert_one({
-            "user_id": ObjectId(user_id),
+        await _refresh_tokens_fast_write.insert_one({
+            "user_id": user["_id"],
             "token": refresh_token,
             "expires_at": refresh_token_expires_at,
             "revoked": False,
@@ -190,7 +230,7 @@ class AuthService:
         }
     
     @staticmethod
-    def get_current_user(token: str) -> UserResponse:
+    async def get_current_user(token: str) -> UserResponse:
         """Get current authenticated user - reads name and role from token"""
         # Decode token
         payload = decode_access_token(token)
@@ -215,7 +255,7 @@ class AuthService:
         
         # Find user by ID to verify account is still active
         try:
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            user = await async_users_collection.find_one({"_id": ObjectId(user_id)}, _USER_RESPONSE_PROJECTION)
         except Exception:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -239,10 +279,23 @@ class AuthService:
         return AuthService._user_to_response(user)
     
     @staticmethod
-    def refresh_access_token(refresh_token: str) -> dict:
+    async def refresh_access_token(refresh_token: str) -> dict:
         """Refresh access token using refresh token"""
-        # Find refresh token in database
-        token_doc = refresh_tokens_collection.find_one({"token": refresh_token})
+        # Find refresh token and its user in a single round-trip
+        pipeline = [
+            {"$match": {"token": refresh_token}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": async_users_collection.name,
+                "localField": "user_id",
+                "foreignField": "_id",
+                "as": "user"
+            }},
+            {"$project": _REFRESH_TOKEN_PROJECTION}
+        ]
+        cursor = await async_refresh_tokens_collection.aggregate(pipeline)
+        token_docs = await cursor.to_list(1)
+        token_doc = token_docs[0] if token_docs else None
         
         if not token_doc:
             raise HTTPException(
@@ -258,16 +311,17 @@ class AuthService:
             )
         
         # Check if token is expired
+        now = datetime.utcnow()
         expires_at = token_doc.get("expires_at")
-        if expires_at and datetime.utcnow() > expires_at:
+        if expires_at and now > expires_at:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Refresh token has expired. Please login again."
             )
         
-        # Get user
+        # Get user (joined by $lookup, empty if the user was deleted)
         user_id = token_doc.get("user_id")
-        user = users_collection.find_one({"_id": user_id})
+        user = token_doc["user"][0] if token_doc.get("user") else None
         
         if not user:
             raise HTTPException(
@@ -288,10 +342,10 @@ class AuthService:
         # Create new access token
         access_token = create_access_token(user_id=str(user_id), name=name, role=role)
         
-        # Update last_used_at
-        refresh_tokens_collection.update_one(
+        # Update last_used_at (fire-and-forget)
+        await _refresh_tokens_unacknowledged_write.update_one(
             {"_id": token_doc["_id"]},
-            {"$set": {"last_used_at": datetime.utcnow()}}
+            {"$set": {"last_used_at": now}}
         )
         
         return {
@@ -300,10 +354,10 @@ class AuthService:
         }
     
     @staticmethod
-    def revoke_refresh_token(refresh_token: str) -> dict:
+    async def revoke_refresh_token(refresh_token: str) -> dict:
         """Revoke a refresh token (logout)"""
         # Find and revoke refresh token
-        result = refresh_tokens_collection.update_one(
+        result = await async_refresh_tokens_collection.update_one(
             {"token": refresh_token},
             {"$set": {"revoked": True}}
         )
@@ -317,9 +371,9 @@ class AuthService:
         return {"message": "Token revoked successfully"}
     
     @staticmethod
-    def revoke_all_user_tokens(user_id: str) -> dict:
+    async def revoke_all_user_tokens(user_id: str) -> dict:
         """Revoke all refresh tokens for a user"""
-        result = refresh_tokens_collection.update_many(
+        result = await async_refresh_tokens_collection.update_many(
             {"user_id": ObjectId(user_id), "revoked": False},
             {"$set": {"revoked": True}}
         )
@@ -327,13 +381,14 @@ class AuthService:
         return {"message": f"Revoked {result.modified_count} tokens"}
     
     @staticmethod
-    def forgot_password(email: str) -> dict:
+    async def forgot_password(email: str, background_tasks: BackgroundTasks) -> dict:
         """
         Request password reset. Always returns success message for security reasons,
         even if account doesn't exist or is disabled.
+        The email is sent by background_tasks after the response.
         """
         # Find user by email
-        user = users_collection.find_one({"email": email})
+        user = await async_users_collection.find_one({"email": email}, _RESET_USER_PROJECTION)
         
         # Security: Always return success message, even if user doesn't exist
         # This prevents email enumeration attacks
@@ -346,7 +401,7 @@ class AuthService:
             reset_token_expires_at = get_reset_password_token_expiration()
             
             # Update user with reset token
-            users_collection.update_one(
+            await async_users_collection.update_one(
                 {"_id": user["_id"]},
                 {
                     "$set": {
@@ -357,16 +412,18 @@ class AuthService:
                 }
             )
             
-            # Send reset password email
-            EmailService.send_reset_password_email(email, reset_token)
+            # Send reset password email once the response has gone out
+            background_tasks.add_task(EmailService.send_reset_password_email, email, reset_token)
         
         return {"message": success_message}
     
     @staticmethod
-    def reset_password(reset_token: str, new_password: str) -> dict:
+    async def reset_password(reset_token: str, new_password: str) -> dict:
         """Reset password using reset token"""
         # Find user by reset token
-        user = users_collection.find_one({"reset_password_token": reset_token})
+        user = await async_users_collection.find_one(
+            {"reset_password_token": reset_token}, _RESET_USER_PROJECTION
+        )
         
         if not user:
             raise HTTPException(
@@ -375,8 +432,9 @@ class AuthService:
             )
         
         # Check if token expired
+        now = datetime.utcnow()
         token_expires_at = user.get("reset_password_expires_at")
-        if token_expires_at and datetime.utcnow() > token_expires_at:
+        if token_expires_at and now > token_expires_at:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Reset token has expired. Please request a new one."
@@ -390,24 +448,31 @@ class AuthService:
             )
         
         # Hash new password
-        hashed_password = get_password_hash(new_password)
+        hashed_password = await aget_password_hash(new_password)
         
-        # Update password and clear reset token
-        users_collection.update_one(
-            {"_id": user["_id"]},
+        # Update password and clear reset token, only if the token is still
+        # set so it can't be used twice
+        password_result = await async_users_collection.update_one(
+            {"_id": user["_id"], "reset_password_token": reset_token},
             {
                 "$set": {
                     "password": hashed_password,
                     "reset_password_token": None,
                     "reset_password_expires_at": None,
-                    "updated_at": datetime.utcnow()
+                    "updated_at": now
                 }
             }
         )
         
-        # Revoke all refresh tokens for security
-        from app.db.mongo import refresh_tokens_collection
-        refresh_tokens_collection.update_many(
+        if password_result.matched_count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid or expired reset token"
+            )
+        
+        # Revoke all refresh tokens for security (only once the password has
+        # actually been changed, so a replayed request logs nobody out)
+        await async_refresh_tokens_collection.update_many(
             {"user_id": user["_id"], "revoked": False},
             {"$set": {"revoked": True}}
         )
@@ -417,13 +482,20 @@ class AuthService:
     @staticmethod
     def _user_to_response(user_dict: dict) -> UserResponse:
         """Convert user dictionary to UserResponse"""
-        return UserResponse(
+        # Fields come straight from our own users collection, skip validation
+        created_at = user_dict.get("created_at")
+        updated_at = user_dict.get("updated_at")
+        if created_at is None or updated_at is None:
+            now = datetime.utcnow()
+            created_at = created_at or now
+            updated_at = updated_at or now
+        return UserResponse.model_construct(
             id=str(user_dict["_id"]),
             email=user_dict["email"],
             role=user_dict.get("role", "student"),
             email_verified=user_dict.get("email_verified", False),
             is_active=user_dict.get("is_active", True),
-            created_at=user_dict.get("created_at", datetime.utcnow()),
-            updated_at=user_dict.get("updated_at", datetime.utcnow())
+            created_at=created_at,
+            updated_at=updated_at
         )
 
@@ -2,7 +2,14 @@ import pandas as pd
 import json
 import numpy as np
 from io import BytesIO
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, BinaryIO, Union
+
+# Use pyarrow's multithreaded CSV parser when installed, pandas' C parser otherwise
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
 
 
 def clean_value(value):
@@ -30,19 +37,51 @@ def parse_moyenne(moy):
 
 class CSVService:
     @staticmethod
-    def process_csv_file(file_content: bytes, year: str) -> Tuple[Dict[int, Any], str]:
+    def _read_csv(file_content: Union[bytes, BinaryIO]) -> pd.DataFrame:
+        """Read the raw CSV grid (no header row) from bytes or a binary file object"""
+        if isinstance(file_content, (bytes, bytearray)):
+            file_content = BytesIO(file_content)
+        start = file_content.tell() if file_content.seekable() else None
+        try:
+            return pd.read_csv(file_content, header=None, engine=CSV_ENGINE)
+        except ValueError:
+            # pyarrow is stricter (e.g. rows with fewer fields), retry with the C parser
+            if CSV_ENGINE == "c" or start is None:
+                raise
+            file_content.seek(start)
+            return pd.read_csv(file_content, header=None)
+    
+    @staticmethod
+    def count_students(file_content: Union[bytes, BinaryIO]) -> Tuple[int, str]:
+        """
+        Count the students in a CSV file without extracting their data
+        
+        Args:
+            file_content: CSV file content as bytes, or a binary file object
+        
+        Returns:
+            Tuple of (number of distinct matricules, semester string)
+        """
+        df = CSVService._read_csv(file_content)
+        semester = "S" + str(df.iloc[0, 1])
+        matricules = df[df.columns[1]].to_numpy()[6:]
+        return len({int(m) for m in matricules if not pd.isna(m)}), semester
+    
+    @staticmethod
+    def process_csv_file(file_content: Union[bytes, BinaryIO], year: str) -> Tuple[Dict[int, Any], str]:
         """
         Process CSV file and extract student data
         
         Args:
-            file_content: CSV file content as bytes
+            file_content: CSV file content as bytes, or a binary file object
+                          (read in chunks by the parser, never fully buffered)
             year: Year string in format "2024-2025"
         
         Returns:
             Tuple of (Dictionary with student data keyed by matricule, semester string)
         """
-        # Read CSV from bytes
-        df = pd.read_csv(BytesIO(file_content), header=None)
+        # Read CSV from bytes or directly from the file object
+        df = CSVService._read_csv(file_content)
         
         semester = "S" + str(df.iloc[0, 1])
         
@@ -73,118 +112,139 @@ class CSVService:
             else:
                 modules[i]["end_col"] = col_idx - 2  # آخر module
         
+        # ========== تخطيط الأعمدة (نفس الشيء لكل الطلاب) ==========
+        # The layout only depends on the header rows, so it is resolved once
+        # here instead of for every student row
+        n_cols = len(df.columns)
+        header_row = 5  # السطر 6 في CSV (index 5)
+        
+        # البحث عن أعمدة Moy General, Credit total, Decision في header
+        moy_general_col = None
+        credit_total_col = None
+        decision_col = None
+        
+        for col in range(n_cols):
+            header_val = df.iloc[header_row, col]
+            if isinstance(header_val, str):
+                header_upper = str(header_val).upper()
+                if "MOY GENERAL" in header_upper or "MOYENNE GENERAL" in header_upper:
+                    moy_general_col = col
+                elif "CREDIT TOTAL" in header_upper or "CREDIT TOT" in header_upper:
+                    credit_total_col = col
+                elif "DECISION" in header_upper:
+                    decision_col = col
+        
+        module_layouts = []
+        for module in modules:
+            start = module["start_col"]
+            end = module["end_col"]
+            
+            matieres_layout = []  # (code, name, first column, coef)
+            last_matiere_col = None  # لتتبع آخر عمود مادة (Capit)
+            
+            col = start
+            
+            # معالجة جميع المواد في module
+            while col <= end:
+                m_full = df.iloc[4, col]
+                coef = df.iloc[3, col]
+                
+                if not isinstance(m_full, str) or ":" not in m_full:
+                    col += 1
+                    continue
+                
+                code, mat_name = m_full.split(":", 1)
+                matieres_layout.append((
+                    code.strip(),
+                    mat_name.strip(),
+                    col,
+                    clean_value(coef) if coef is not None else 0
+                ))
+                
+                last_matiere_col = col + 4  # آخر عمود في هذه المادة (Capit)
+                col += 5
+            
+            # البحث عن MOYENNE UE و UE Valide بعد آخر مادة
+            moyenne_col = None
+            UE_valide_col = None
+            
+            if last_matiere_col is not None:
+                # البحث في نطاق module عن "MOYENNE UE" و "UE Valide"
+                for search_col in range(start, min(end + 5, n_cols)):
+                    header_val = df.iloc[header_row, search_col]
+                    if isinstance(header_val, str):
+                        header_upper = str(header_val).upper()
+                        if "MOYENNE UE" in header_upper and moyenne_col is None:
+                            moyenne_col = search_col
+                        elif "UE VALIDE" in header_upper or "UE VALID" in header_upper:
+                            UE_valide_col = search_col
+                            if moyenne_col is None:
+                                # إذا وجدنا UE Valide قبل MOYENNE UE، فالمتوسط في العمود السابق
+                                moyenne_col = search_col - 1
+                            break
+                
+                # إذا لم نجد، نستخدم العمودين التاليين مباشرة بعد آخر مادة
+                if moyenne_col is None:
+                    moyenne_col = last_matiere_col + 1
+                if UE_valide_col is None:
+                    UE_valide_col = moyenne_col + 1
+            
+            if moyenne_col is not None and moyenne_col >= n_cols:
+                moyenne_col = None
+            if UE_valide_col is not None and UE_valide_col >= n_cols:
+                UE_valide_col = None
+            
+            module_layouts.append((
+                module["code"], module["name"], matieres_layout, moyenne_col, UE_valide_col
+            ))
+        
         # ========== استخراج بيانات الطلاب ==========
+        # One NumPy array per column: plain indexing instead of df.iloc,
+        # and each value keeps the type iloc would return
+        columns = [df[col].to_numpy() for col in df.columns]
         students = {}
         
         for row in range(6, len(df)):
-            dept = df.iloc[row, 0]
-            matricule = df.iloc[row, 1]
-            prenom = df.iloc[row, 2]
-            nom = df.iloc[row, 3]
+            matricule = columns[1][row]
             
             if pd.isna(matricule):
                 continue
             
-            students[int(matricule)] = {
-                "matricule": int(matricule),
-                "department": dept,
-                "prenom": prenom,
-                "nom": nom,
-                semester: {
-                    "year": year,
-                    "isPublic": False
-                }
+            matricule = int(matricule)
+            semester_data = {
+                "year": year,
+                "isPublic": False
+            }
+            students[matricule] = {
+                "matricule": matricule,
+                "department": columns[0][row],
+                "prenom": columns[2][row],
+                "nom": columns[3][row],
+                semester: semester_data
             }
             
-            # البحث عن أعمدة Moy General, Credit total, Decision في header
-            header_row = 5
-            moy_general_col = None
-            credit_total_col = None
-            decision_col = None
-            
-            for col in range(len(df.columns)):
-                header_val = df.iloc[header_row, col]
-                if isinstance(header_val, str):
-                    header_upper = str(header_val).upper()
-                    if "MOY GENERAL" in header_upper or "MOYENNE GENERAL" in header_upper:
-                        moy_general_col = col
-                    elif "CREDIT TOTAL" in header_upper or "CREDIT TOT" in header_upper:
-                        credit_total_col = col
-                    elif "DECISION" in header_upper:
-                        decision_col = col
-            
-            for module in modules:
-                module_code = module["code"]
-                module_name = module["name"]
-                
-                start = module["start_col"]
-                end = module["end_col"]
-                
+            for module_code, module_name, matieres_layout, moyenne_col, UE_valide_col in module_layouts:
                 matieres = {}
-                last_matiere_col = None  # لتتبع آخر عمود مادة (Capit)
-                
-                col = start
-                header_row = 5  # السطر 6 في CSV (index 5)
-                
-                # معالجة جميع المواد في module
-                while col <= end:
-                    m_full = df.iloc[4, col]
-                    coef = df.iloc[3, col]
-                    
-                    if not isinstance(m_full, str) or ":" not in m_full:
-                        col += 1
-                        continue
-                    
-                    code, mat_name = m_full.split(":", 1)
-                    code = code.strip()
-                    mat_name = mat_name.strip()
-                    
-                    notes = {
-                        "NCC": clean_value(df.iloc[row, col]),
-                        "NSN": clean_value(df.iloc[row, col+1]),
-                        "NSR": clean_value(df.iloc[row, col+2]),
-                        "Moy": clean_value(df.iloc[row, col+3]),
-                        "Capit": df.iloc[row, col+4] if not pd.isna(df.iloc[row, col+4]) else None
-                    }
-                    
+                for code, mat_name, col, coef in matieres_layout:
+                    capit = columns[col + 4][row]
                     matieres[code] = {
                         "name": mat_name,
-                        "notes": notes,
-                        "coef": clean_value(coef) if coef is not None else 0
+                        "notes": {
+                            "NCC": clean_value(columns[col][row]),
+                            "NSN": clean_value(columns[col + 1][row]),
+                            "NSR": clean_value(columns[col + 2][row]),
+                            "Moy": clean_value(columns[col + 3][row]),
+                            "Capit": capit if not pd.isna(capit) else None
+                        },
+                        "coef": coef
                     }
-                    
-                    last_matiere_col = col + 4  # آخر عمود في هذه المادة (Capit)
-                    col += 5
-                
-                # البحث عن MOYENNE UE و UE Valide بعد آخر مادة
-                moyenne_col = None
-                UE_valide_col = None
-                
-                if last_matiere_col is not None:
-                    # البحث في نطاق module عن "MOYENNE UE" و "UE Valide"
-                    for search_col in range(start, min(end + 5, len(df.columns))):
-                        header_val = df.iloc[header_row, search_col]
-                        if isinstance(header_val, str):
-                            header_upper = str(header_val).upper()
-                            if "MOYENNE UE" in header_upper and moyenne_col is None:
-                                moyenne_col = search_col
-                            elif "UE VALIDE" in header_upper or "UE VALID" in header_upper:
-                                UE_valide_col = search_col
-                                if moyenne_col is None:
-                                    # إذا وجدنا UE Valide قبل MOYENNE UE، فالمتوسط في العمود السابق
-                                    moyenne_col = search_col - 1
-                                break
-                    
-                    # إذا لم نجد، نستخدم العمودين التاليين مباشرة بعد آخر مادة
-                    if moyenne_col is None:
-                        moyenne_col = last_matiere_col + 1
-                    if UE_valide_col is None:
-                        UE_valide_col = moyenne_col + 1
                 
-                moyenne = clean_value(df.iloc[row, moyenne_col]) if moyenne_col is not None and moyenne_col < len(df.columns) else 0
-                UE_valide = df.iloc[row, UE_valide_col] if UE_valide_col is not None and UE_valide_col < len(df.columns) and not pd.isna(df.iloc[row, UE_valide_col]) else None
+                moyenne = clean_value(columns[moyenne_col][row]) if moyenne_col is not None else 0
+                UE_valide = None
+                if UE_valide_col is not None and not pd.isna(columns[UE_valide_col][row]):
+                    UE_valide = columns[UE_valide_col][row]
                 
-                students[int(matricule)][semester][module_code] = {
+                semester_data[module_code] = {
                     "name": module_name,
                     "matieres": matieres,
                     "moyenne": moyenne,
@@ -193,21 +253,21 @@ class CSVService:
             
             # إضافة Moy General, Credit total, Decision في الـ semester
             if moy_general_col is not None:
-                moy_gen = df.iloc[row, moy_general_col] if moy_general_col < len(df.columns) else None
-                students[int(matricule)][semester]["moyenne_generale"] = clean_value(moy_gen)
+                moy_gen = columns[moy_general_col][row]
+                semester_data["moyenne_generale"] = clean_value(moy_gen)
             if credit_total_col is not None:
-                credit_total = df.iloc[row, credit_total_col] if credit_total_col < len(df.columns) else None
+                credit_total = columns[credit_total_col][row]
                 # تحويل إلى int إذا كان رقم
                 try:
                     if credit_total is not None and not pd.isna(credit_total) and str(credit_total).strip():
-                        students[int(matricule)][semester]["credit_total"] = int(float(str(credit_total).replace(',', '.')))
+                        semester_data["credit_total"] = int(float(str(credit_total).replace(',', '.')))
                     else:
-                        students[int(matricule)][semester]["credit_total"] = 0
+                        semester_data["credit_total"] = 0
                 except:
-                    students[int(matricule)][semester]["credit_total"] = 0
+                    semester_data["credit_total"] = 0
             if decision_col is not None:
-                decision = df.iloc[row, decision_col] if decision_col < len(df.columns) else None
-                students[int(matricule)][semester]["decision"] = decision if not pd.isna(decision) else None
+                decision = columns[decision_col][row]
+                semester_data["decision"] = decision if not pd.isna(decision) else None
         
         # ========== إضافة الترتيب حسب moyenne_generale ==========
         
@@ -1,21 +1,34 @@
 import smtplib
+import threading
+from email.message import Message
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+from typing import Optional
 from app.core.config import settings
 
+# Seconds to wait on the SMTP server before giving up
+SMTP_TIMEOUT = 30
 
-class EmailService:
-    @staticmethod
-    def _get_verification_email_template(verification_link: str, email: str) -> str:
-        """Generate beautiful HTML email template for email verification"""
-        return f"""
+# Messages sent before the shared connection is reopened (providers cap
+# the number of messages accepted per connection)
+SMTP_MAX_MESSAGES_PER_CONNECTION = 100
+
+# Authenticated SMTP connection reused across emails (servers close idle
+# connections, in which case a new one is opened)
+_smtp_connection: Optional[smtplib.SMTP] = None
+_smtp_sent_count = 0
+_smtp_lock = threading.RLock()
+
+# HTML layout shared by the emails asking the user to follow a link;
+# {link} and {year} are left as placeholders and filled in per email
+_ACTION_EMAIL_TEMPLATE = """
         <!DOCTYPE html>
         <html lang="fr">
         <head>
             <meta charset="UTF-8">
             <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Vérification de votre email - SupNum Résultats</title>
+            <title>{title}</title>
         </head>
         <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f4f4;">
             <table role="presentation" style="width: 100%; border-collapse: collapse; background-color: #f4f4f4; padding: 20px;">
@@ -38,7 +51,7 @@ class EmailService:
                             <tr>
                                 <td style="padding: 40px 30px;">
                                     <h2 style="color: #333333; margin: 0 0 20px 0; font-size: 24px; font-weight: 600;">
-                                        Bienvenue sur SupNum Résultats !
+                                        {heading}
                                     </h2>
                                     
                                     <p style="color: #666666; font-size: 16px; line-height: 1.6; margin: 0 0 20px 0;">
@@ -46,20 +59,20 @@ class EmailService:
                                     </p>
                                     
                                     <p style="color: #666666; font-size: 16px; line-height: 1.6; margin: 0 0 30px 0;">
-                                        Merci de vous être inscrit sur <strong>SupNum Résultats</strong>, la plateforme de résultats de l'Institut Supérieur du Numérique.
+                                        {intro}
                                     </p>
                                     
                                     <p style="color: #666666; font-size: 16px; line-height: 1.6; margin: 0 0 30px 0;">
-                                        Pour finaliser votre inscription et accéder à votre compte, veuillez confirmer votre adresse email en cliquant sur le bouton ci-dessous :
+                                        {instructions}
                                     </p>
                                     
                                     <!-- Button -->
                                     <table role="presentation" style="width: 100%; margin: 30px 0;">
                                         <tr>
                                             <td align="center" style="padding: 15px 0;">
-                                                <a href="{verification_link}" 
+                                                <a href="{{link}}" 
                                                    style="display: inline-block; padding: 15px 40px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: #ffffff; text-decoration: none; border-radius: 5px; font-weight: 600; font-size: 16px; box-shadow: 0 4px 6px rgba(102, 126, 234, 0.3);">
-                                                    Vérifier mon email
+                                                    {button_label}
                                                 </a>
                                             </td>
                                         </tr>
@@ -70,12 +83,12 @@ class EmailService:
                                     </p>
                                     
                                     <p style="color: #667eea; font-size: 14px; line-height: 1.6; margin: 10px 0 0 0; word-break: break-all;">
-                                        <a href="{verification_link}" style="color: #667eea; text-decoration: none;">{verification_link}</a>
+                                        <a href="{{link}}" style="color: #667eea; text-decoration: none;">{{link}}</a>
                                     </p>
                                     
                                     <div style="border-top: 1px solid #e0e0e0; margin: 40px 0 20px 0; padding-top: 20px;">
                                         <p style="color: #999999; font-size: 12px; line-height: 1.6; margin: 0;">
-                                            <strong>Note importante :</strong> Ce lien est valide pendant 24 heures. Si vous n'avez pas créé de compte sur <strong>SupNum Résultats</strong>, veuillez ignorer cet email.
+                                            <strong>Note importante :</strong> {note}
                                         </p>
                                     </div>
                                 </td>
@@ -91,7 +104,7 @@ class EmailService:
                                         Institut Supérieur du Numérique
                                     </p>
                                     <p style="color: #999999; font-size: 12px; margin: 0;">
-                                        © {datetime.now().year} Institut Supérieur du Numérique. Tous droits réservés.
+                                        © {{year}} Institut Supérieur du Numérique. Tous droits réservés.
                                     </p>
                                 </td>
                             </tr>
@@ -102,6 +115,81 @@ class EmailService:
         </body>
         </html>
         """
+
+_VERIFICATION_EMAIL_TEMPLATE = _ACTION_EMAIL_TEMPLATE.format(
+    title="Vérification de votre email - SupNum Résultats",
+    heading="Bienvenue sur SupNum Résultats !",
+    intro="Merci de vous être inscrit sur <strong>SupNum Résultats</strong>, la plateforme de résultats de l'Institut Supérieur du Numérique.",
+    instructions="Pour finaliser votre inscription et accéder à votre compte, veuillez confirmer votre adresse email en cliquant sur le bouton ci-dessous :",
+    button_label="Vérifier mon email",
+    note="Ce lien est valide pendant 24 heures. Si vous n'avez pas créé de compte sur <strong>SupNum Résultats</strong>, veuillez ignorer cet email."
+)
+
+_RESET_PASSWORD_EMAIL_TEMPLATE = _ACTION_EMAIL_TEMPLATE.format(
+    title="Réinitialisation de votre mot de passe - SupNum Résultats",
+    heading="Réinitialisation de votre mot de passe",
+    intro="Vous avez demandé à réinitialiser votre mot de passe pour votre compte <strong>SupNum Résultats</strong>.",
+    instructions="Cliquez sur le bouton ci-dessous pour créer un nouveau mot de passe :",
+    button_label="Réinitialiser mon mot de passe",
+    note="Ce lien est valide pendant 1 heure. Si vous n'avez pas demandé de réinitialisation de mot de passe, veuillez ignorer cet email. Votre mot de passe ne sera pas modifié."
+)
+
+
+class EmailService:
+    @staticmethod
+    def _connect() -> smtplib.SMTP:
+        """Open and authenticate a new SMTP connection"""
+        server = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls()
+            server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    @staticmethod
+    def _send_message(msg: Message) -> None:
+        """Send a message over the shared SMTP connection, reconnecting once if it was dropped"""
+        global _smtp_connection, _smtp_sent_count
+        with _smtp_lock:
+            if _smtp_sent_count >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                EmailService.close()
+            for attempt in range(2):
+                if _smtp_connection is None:
+                    _smtp_connection = EmailService._connect()
+                    _smtp_sent_count = 0
+                try:
+                    _smtp_connection.send_message(msg)
+                    _smtp_sent_count += 1
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    _smtp_connection = None
+                    if attempt:
+                        raise
+                except smtplib.SMTPRecipientsRefused:
+                    # Connection is still usable, only this message failed
+                    raise
+                except Exception:
+                    EmailService.close()
+                    raise
+    
+    @staticmethod
+    def close() -> None:
+        """Close the shared SMTP connection (on shutdown)"""
+        global _smtp_connection
+        with _smtp_lock:
+            if _smtp_connection is not None:
+                try:
+                    _smtp_connection.quit()
+                except Exception:
+                    _smtp_connection.close()
+                _smtp_connection = None
+    
+    @staticmethod
+    def _get_verification_email_template(verification_link: str, email: str) -> str:
+        """Generate beautiful HTML email template for email verification"""
+        return _VERIFICATION_EMAIL_TEMPLATE.format(link=verification_link, year=datetime.now().year)
     
     @staticmethod
     def send_verification_email(email: str, verification_token: str) -> bool:
@@ -123,11 +211,7 @@ class EmailService:
             
             # Send email
             if settings.SMTP_USER and settings.SMTP_PASSWORD:
-                server = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT)
-                server.starttls()
-                server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-                server.send_message(msg)
-                server.quit()
+                EmailService._send_message(msg)
                 return True
             else:
                 # In development, just print the link
@@ -140,99 +224,7 @@ class EmailService:
     @staticmethod
     def _get_reset_password_email_template(reset_link: str, email: str) -> str:
         """Generate beautiful HTML email template for password reset"""
-        return f"""
-        <!DOCTYPE html>
-        <html lang="fr">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Réinitialisation de votre mot de passe - SupNum Résultats</title>
-        </head>
-        <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f4f4;">
-            <table role="presentation" style="width: 100%; border-collapse: collapse; background-color: #f4f4f4; padding: 20px;">
-                <tr>
-                    <td align="center" style="padding: 20px 0;">
-                        <table role="presentation" style="width: 600px; max-width: 100%; background-color: #ffffff; border-radius: 10px; box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1); overflow: hidden;">
-                            <!-- Header -->
-                            <tr>
-                                <td style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 40px 30px; text-align: center;">
-                                    <h1 style="color: #ffffff; margin: 0; font-size: 32px; font-weight: 700; letter-spacing: 1px;">
-                                        SupNum Résultats
-                                    </h1>
-                                    <p style="color: #ffffff; margin: 10px 0 0 0; font-size: 16px; opacity: 0.9;">
-                                        Plateforme de Résultats
-                                    </p>
-                                </td>
-                            </tr>
-                            
-                            <!-- Content -->
-                            <tr>
-                                <td style="padding: 40px 30px;">
-                                    <h2 style="color: #333333; margin: 0 0 20px 0; font-size: 24px; font-weight: 600;">
-                                        Réinitialisation de votre mot de passe
-                                    </h2>
-                                    
-                                    <p style="color: #666666; font-size: 16px; line-height: 1.6; margin: 0 0 20px 0;">
-                                        Bonjour,
-                                    </p>
-                                    
-                                    <p style="color: #666666; font-size: 16px; line-height: 1.6; margin: 0 0 30px 0;">
-                                        Vous avez demandé à réinitialiser votre mot de passe pour votre compte <strong>SupNum Résultats</strong>.
-                                    </p>
-                                    
-                                    <p style="color: #666666; font-size: 16px; line-height: 1.6; margin: 0 0 30px 0;">
-                                        Cliquez sur le bouton ci-dessous pour créer un nouveau mot de passe :
-                                    </p>
-                                    
-                                    <!-- Button -->
-                                    <table role="presentation" style="width: 100%; margin: 30px 0;">
-                                        <tr>
-                                            <td align="center" style="padding: 15px 0;">
-                                                <a href="{reset_link}" 
-                                                   style="display: inline-block; padding: 15px 40px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: #ffffff; text-decoration: none; border-radius: 5px; font-weight: 600; font-size: 16px; box-shadow: 0 4px 6px rgba(102, 126, 234, 0.3);">
-                                                    Réinitialiser mon mot de passe
-                                                </a>
-                                            </td>
-                                        </tr>
-                                    </table>
-                                    
-                                    <p style="color: #999999; font-size: 14px; line-height: 1.6; margin: 30px 0 0 0;">
-                                        Si le bouton ne fonctionne pas, copiez et collez le lien suivant dans votre navigateur :
-                                    </p>
-                                    
-                                    <p style="color: #667eea; font-size: 14px; line-height: 1.6; margin: 10px 0 0 0; word-break: break-all;">
-                                        <a href="{reset_link}" style="color: #667eea; text-decoration: none;">{reset_link}</a>
-                                    </p>
-                                    
-                                    <div style="border-top: 1px solid #e0e0e0; margin: 40px 0 20px 0; padding-top: 20px;">
-                                        <p style="color: #999999; font-size: 12px; line-height: 1.6; margin: 0;">
-                                            <strong>Note importante :</strong> Ce lien est valide pendant 1 heure. Si vous n'avez pas demandé de réinitialisation de mot de passe, veuillez ignorer cet email. Votre mot de passe ne sera pas modifié.
-                                        </p>
-                                    </div>
-                                </td>
-                            </tr>
-                            
-                            <!-- Footer -->
-                            <tr>
-                                <td style="background-color: #f8f9fa; padding: 30px; text-align: center; border-top: 1px solid #e0e0e0;">
-                                    <p style="color: #666666; font-size: 14px; margin: 0 0 10px 0;">
-                                        <strong>SupNum</strong> - Plateforme de Résultats
-                                    </p>
-                                    <p style="color: #999999; font-size: 12px; margin: 0 0 10px 0;">
-                                        Institut Supérieur du Numérique
-                                    </p>
-                                    <p style="color: #999999; font-size: 12px; margin: 0;">
-                                        © {datetime.now().year} Institut Supérieur du Numérique. Tous droits réservés.
-                                    </p>
-                                </td>
-                            </tr>
-                        </table>
-                    </td>
-                </tr>
-            </table>
-        </body>
-        </html>
-        """
+        return _RESET_PASSWORD_EMAIL_TEMPLATE.format(link=reset_link, year=datetime.now().year)
     
     @staticmethod
     def send_reset_password_email(email: str, reset_token: str) -> bool:
@@ -254,11 +246,7 @@ class EmailService:
             
             # Send email
             if settings.SMTP_USER and settings.SMTP_PASSWORD:
-                server = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT)
-                server.starttls()
-                server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-                server.send_message(msg)
-                server.quit()
+                EmailService._send_message(msg)
                 return True
             else:
                 # In development, just print the link
@@ -1,10 +1,80 @@
-from typing import Dict, Any, List, Optional, Tuple
-from app.db.mongo import notes_collection
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+from app.db.mongo import notes_collection, async_notes_collection
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from cachetools import TTLCache
 from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
 import re
+import threading
+
+# Short-lived cache of read results (notes lists and statistics) keyed by
+# query name and filters. Cleared whenever notes are written.
+# Request-path reads and the visibility toggles use the asyncio client
+# (async_notes_collection); CSV imports and deletions use the sync one.
+_query_cache = TTLCache(maxsize=256, ttl=60)
+_query_cache_lock = threading.Lock()
+
+# Maximum number of operations sent in one bulk_write call
+BULK_WRITE_BATCH_SIZE = 1000
+
+# Top-level fields of a notes document kept by the public view (besides public semesters)
+_PUBLIC_PROFILE_FIELDS = ["_id", "matricule", "department", "prenom", "nom", "niveau", "isPublicGlobale"]
+
+# Fields of an existing document read when merging new notes: the current
+# niveau and what the L2/L3 promotion checks look at
+_NIVEAU_PROJECTION = {
+    "niveau": 1,
+    **{f"S{n}.{field}": 1 for n in range(1, 5) for field in ("moyenne_generale", "credit_total")}
+}
+
+# Reduces every student to what rank calculation reads: _id, department,
+# niveau and each semester's moyenne_generale (semester keys are dynamic,
+# so the fields are selected with $objectToArray rather than a projection)
+_RANK_INPUTS_PIPELINE = [
+    {"$replaceRoot": {"newRoot": {"$arrayToObject": {"$map": {
+        "input": {"$filter": {
+            "input": {"$objectToArray": "$$ROOT"},
+            "as": "kv",
+            "cond": {"$or": [
+                {"$in": ["$$kv.k", ["_id", "department", "niveau"]]},
+                {"$and": [
+                    {"$eq": [{"$type": "$$kv.v"}, "object"]},
+                    {"$ne": [{"$type": "$$kv.v.moyenne_generale"}, "missing"]}
+                ]}
+            ]}
+        }},
+        "as": "kv",
+        "in": {
+            "k": "$$kv.k",
+            "v": {"$cond": [
+                {"$eq": [{"$type": "$$kv.v"}, "object"]},
+                {"moyenne_generale": "$$kv.v.moyenne_generale"},
+                "$$kv.v"
+            ]}
+        }
+    }}}}}
+]
 
 
 class NoteService:
+    @staticmethod
+    async def _cached(key: tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return cached result for key, computing and storing it on a miss"""
+        with _query_cache_lock:
+            if key in _query_cache:
+                return _query_cache[key]
+        result = await compute()
+        with _query_cache_lock:
+            _query_cache[key] = result
+        return result
+    
+    @staticmethod
+    def clear_cache() -> None:
+        """Invalidate cached read results (call after any write to notes)"""
+        with _query_cache_lock:
+            _query_cache.clear()
+    
     @staticmethod
     def get_niveau_from_semester(semester: str) -> str:
         """
@@ -283,33 +353,33 @@ class NoteService:
                 # Same niveau but different year, update to new year
                 return (True, new_niveau_str)
     @staticmethod
-    def save_student_notes(student_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _build_notes_write(
+        student_data: Dict[str, Any],
+        existing: Optional[Dict[str, Any]],
+        now: datetime
+    ) -> Tuple[str, Dict[str, Any]]:
         """
-        Save or update student notes in MongoDB.
-        Uses matricule as the _id (unique identifier) for upsert operation.
-        Merges new data with existing data instead of replacing it completely.
-        This allows adding new semesters without losing existing ones.
+        Build the write saving one student's notes.
+        Merges new data with the existing document if there is one,
+        otherwise creates a new document.
         
         Args:
             student_data: Dictionary containing student data with 'matricule' key
+            existing: Current document for this matricule, or None
+            now: Timestamp stored as updated_at (and created_at for new documents)
         
         Returns:
-            Dictionary with operation result
+            Tuple of (operation, document): ("updated", update document)
+            for an existing student, ("created", new document) otherwise
         """
-        if "matricule" not in student_data:
-            raise ValueError("student_data must contain 'matricule' key")
-        
         matricule = student_data["matricule"]
         
-        # Check if document exists
-        existing = notes_collection.find_one({"_id": matricule})
-        
         if existing:
             # Document exists: merge new data with existing data
             # Create update document that merges data instead of replacing
             update_doc = {
                 "$set": {
-                    "updated_at": datetime.utcnow()
+                    "updated_at": now
                 }
             }
             
@@ -350,45 +420,71 @@ class NoteService:
                 if should_update:
                     update_doc["$set"]["niveau"] = new_niveau
             
-            # Perform update
+            return ("updated", update_doc)
+        
+        # Document doesn't exist: create new one
+        document = {
+            "_id": matricule,
+            **student_data,
+            "isPublicGlobale": False,  # Default value for new students
+            "created_at": now,
+            "updated_at": now
+        }
+        
+        # Calculate and set niveau for new document
+        # Find semester and year from student_data
+        new_semester = None
+        new_year = None
+        
+        for key, value in student_data.items():
+            if key not in ["matricule", "department", "prenom", "nom"] and isinstance(value, dict):
+                if "year" in value:
+                    new_semester = key
+                    new_year = value.get("year")
+                    break
+        
+        if new_semester and new_year:
+            # For new students, check promotion conditions
+            should_update, new_niveau = NoteService.should_update_niveau(
+                None, new_semester, new_year, document
+            )
+            document["niveau"] = new_niveau
+        
+        return ("created", document)
+    
+    @staticmethod
+    def save_student_notes(student_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Save or update student notes in MongoDB.
+        Uses matricule as the _id (unique identifier) for upsert operation.
+        Merges new data with existing data instead of replacing it completely.
+        This allows adding new semesters without losing existing ones.
+        
+        Args:
+            student_data: Dictionary containing student data with 'matricule' key
+        
+        Returns:
+            Dictionary with operation result
+        """
+        if "matricule" not in student_data:
+            raise ValueError("student_data must contain 'matricule' key")
+        
+        matricule = student_data["matricule"]
+        
+        # Check if document exists
+        existing = notes_collection.find_one({"_id": matricule}, _NIVEAU_PROJECTION)
+        operation, document = NoteService._build_notes_write(student_data, existing, datetime.utcnow())
+        
+        if existing:
             result = notes_collection.update_one(
                 {"_id": matricule},
-                update_doc,
+                document,
                 upsert=False
             )
-            
-            operation = "updated"
         else:
-            # Document doesn't exist: create new one
-            document = {
-                "_id": matricule,
-                **student_data,
-                "isPublicGlobale": False,  # Default value for new students
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Calculate and set niveau for new document
-            # Find semester and year from student_data
-            new_semester = None
-            new_year = None
-            
-            for key, value in student_data.items():
-                if key not in ["matricule", "department", "prenom", "nom"] and isinstance(value, dict):
-                    if "year" in value:
-                        new_semester = key
-                        new_year = value.get("year")
-                        break
-            
-            if new_semester and new_year:
-                # For new students, check promotion conditions
-                should_update, new_niveau = NoteService.should_update_niveau(
-                    None, new_semester, new_year, document
-                )
-                document["niveau"] = new_niveau
-            
             result = notes_collection.insert_one(document)
-            operation = "created"
+        
+        NoteService.clear_cache()
         
         # Prepare return value
         if existing:
@@ -414,6 +510,10 @@ class NoteService:
     def save_multiple_students_notes(students_data: Dict[int, Any]) -> Dict[str, Any]:
         """
         Save or update multiple students' notes in MongoDB.
+        Existing documents are fetched with one query and all writes are
+        sent as unordered bulk writes (BULK_WRITE_BATCH_SIZE operations each),
+        so a failing student doesn't stop the others. If a whole batch fails
+        the remaining batches are not sent and "aborted" is set.
         
         Args:
             students_data: Dictionary with matricule as key and student data as value
@@ -425,22 +525,70 @@ class NoteService:
             "total": len(students_data),
             "created": 0,
             "updated": 0,
-            "errors": []
+            "errors": [],
+            "aborted": False
         }
         
+        matricules = [
+            student_data["matricule"]
+            for student_data in students_data.values()
+            if "matricule" in student_data
+        ]
+        existing_docs = {
+            doc["_id"]: doc
+            for doc in notes_collection.find({"_id": {"$in": matricules}}, _NIVEAU_PROJECTION)
+        }
+        
+        # (matricule key, operation name, write op) for each student
+        writes = []
+        now = datetime.utcnow()
         for matricule, student_data in students_data.items():
             try:
-                result = NoteService.save_student_notes(student_data)
-                if result["operation"] == "created":
-                    results["created"] += 1
+                if "matricule" not in student_data:
+                    raise ValueError("student_data must contain 'matricule' key")
+                existing = existing_docs.get(student_data["matricule"])
+                operation, document = NoteService._build_notes_write(student_data, existing, now)
+                if existing:
+                    op = UpdateOne({"_id": student_data["matricule"]}, document)
                 else:
-                    results["updated"] += 1
+                    op = InsertOne(document)
+                writes.append((matricule, operation, op))
             except Exception as e:
                 results["errors"].append({
                     "matricule": matricule,
                     "error": str(e)
                 })
         
+        for start in range(0, len(writes), BULK_WRITE_BATCH_SIZE):
+            batch = writes[start:start + BULK_WRITE_BATCH_SIZE]
+            failed = {}
+            try:
+                notes_collection.bulk_write([op for _, _, op in batch], ordered=False)
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    failed[write_error["index"]] = write_error.get("errmsg", "Write error")
+            except PyMongoError as e:
+                # The whole batch failed (e.g. database unreachable): the
+                # remaining batches would fail the same way, so stop here
+                print(f"Error saving notes, aborting import: {e}")
+                results["errors"].extend(
+                    {"matricule": matricule, "error": str(e)}
+                    for matricule, _, _ in writes[start:]
+                )
+                results["aborted"] = True
+                break
+            
+            for index, (matricule, operation, _) in enumerate(batch):
+                if index in failed:
+                    results["errors"].append({
+                        "matricule": matricule,
+                        "error": failed[index]
+                    })
+                else:
+                    results[operation] += 1
+        
+        NoteService.clear_cache()
+        
         return results
     
     @staticmethod
@@ -579,7 +727,11 @@ class NoteService:
         return ranks
     
     @staticmethod
-    def add_computed_fields(student_doc: Dict[str, Any], all_students: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def add_computed_fields(
+        student_doc: Dict[str, Any],
+        all_students: List[Dict[str, Any]] = None,
+        ranks: Optional[Dict[int, Dict[str, int]]] = None
+    ) -> Dict[str, Any]:
         """
         Add computed fields to student document.
         These fields are calculated dynamically and not stored in database.
@@ -587,6 +739,8 @@ class NoteService:
         Args:
             student_doc: Student document
             all_students: Optional list of all students for rank calculation
+            ranks: Optional result of calculate_all_semester_ranks(all_students),
+                   to avoid recomputing it for every document
         
         Returns:
             Student document with computed fields added
@@ -597,7 +751,8 @@ class NoteService:
         
         # Calculate ranks if all_students provided
         if all_students:
-            ranks = NoteService.calculate_all_semester_ranks(all_students)
+            if ranks is None:
+                ranks = NoteService.calculate_all_semester_ranks(all_students)
             matricule = student_doc.get("_id") or student_doc.get("matricule")
             # Convert to int if it's a string (for comparison with ranks dict keys)
             if isinstance(matricule, str):
@@ -619,7 +774,35 @@ class NoteService:
         return student_doc
     
     @staticmethod
-    def get_student_public_notes(matricule: int) -> Optional[Dict[str, Any]]:
+    def _add_computed_fields_to_all(
+        documents: List[Dict[str, Any]],
+        all_students: List[Dict[str, Any]]
+    ) -> None:
+        """Add computed fields to every document (CPU-bound, run in a worker thread)"""
+        # Ranks depend only on all_students, so compute them once for the whole list
+        ranks = NoteService.calculate_all_semester_ranks(all_students)
+        for doc in documents:
+            NoteService.add_computed_fields(doc, all_students, ranks)
+    
+    @staticmethod
+    async def _find_all_students() -> List[Dict[str, Any]]:
+        """Get all student documents with _id converted to string"""
+        all_students = await async_notes_collection.find({}).to_list(None)
+        for s in all_students:
+            s["_id"] = str(s["_id"])
+        return all_students
+    
+    @staticmethod
+    async def _find_rank_inputs() -> List[Dict[str, Any]]:
+        """Get every student reduced to the fields used for rank calculation"""
+        cursor = await async_notes_collection.aggregate(_RANK_INPUTS_PIPELINE)
+        all_students = await cursor.to_list(None)
+        for s in all_students:
+            s["_id"] = str(s["_id"])
+        return all_students
+    
+    @staticmethod
+    async def get_student_public_notes(matricule: int) -> Optional[Dict[str, Any]]:
         """
         Get student notes with only public semesters (isPublic = true).
         Returns student information and only semesters that are marked as public.
@@ -630,9 +813,24 @@ class NoteService:
         Returns:
             Student notes document with only public semesters, or None if not found
         """
-        document = notes_collection.find_one({"_id": matricule})
-        if not document:
+        # Let MongoDB drop private semesters (and timestamps) so they never
+        # leave the database; semester keys are dynamic, hence $objectToArray
+        pipeline = [
+            {"$match": {"_id": matricule}},
+            {"$replaceRoot": {"newRoot": {"$arrayToObject": {"$filter": {
+                "input": {"$objectToArray": "$$ROOT"},
+                "as": "kv",
+                "cond": {"$or": [
+                    {"$in": ["$$kv.k", _PUBLIC_PROFILE_FIELDS]},
+                    {"$eq": ["$$kv.v.isPublic", True]}
+                ]}
+            }}}}}
+        ]
+        cursor = await async_notes_collection.aggregate(pipeline)
+        documents = await cursor.to_list(1)
+        if not documents:
             return None
+        document = documents[0]
         
         # Convert _id (matricule) to string for JSON serialization
         document["_id"] = str(document["_id"])
@@ -660,18 +858,18 @@ class NoteService:
         # Add computed fields only if isPublicGlobale is true
         if is_public_globale:
             # Get all students for rank calculation (needed for computed fields)
-            all_students = list(notes_collection.find())
-            for s in all_students:
-                s["_id"] = str(s["_id"])
+            all_students = await NoteService._find_rank_inputs()
             
             # Add computed fields
-            filtered_doc = NoteService.add_computed_fields(filtered_doc, all_students)
+            filtered_doc = await run_in_threadpool(
+                NoteService.add_computed_fields, filtered_doc, all_students
+            )
         # If isPublicGlobale is false, don't include computed fields at all
         
         return filtered_doc
     
     @staticmethod
-    def get_student_notes(matricule: int) -> Dict[str, Any]:
+    async def get_student_notes(matricule: int) -> Dict[str, Any]:
         """
         Get student notes by matricule.
         Includes computed fields: moyenne_generale_allsemestre, rang_generall_allsemestre, rang_allsemestre_dep.
@@ -682,44 +880,85 @@ class NoteService:
         Returns:
             Student notes document with computed fields or None if not found
         """
-        document = notes_collection.find_one({"_id": matricule})
+        document = await async_notes_collection.find_one({"_id": matricule})
         if document:
             # Convert _id (matricule) to string for JSON serialization
             document["_id"] = str(document["_id"])
             
             # Get all students for rank calculation
-            all_students = list(notes_collection.find())
-            # Convert _id to string for consistency
-            for s in all_students:
-                s["_id"] = str(s["_id"])
+            all_students = await NoteService._find_rank_inputs()
             
             # Add computed fields
-            document = NoteService.add_computed_fields(document, all_students)
+            document = await run_in_threadpool(
+                NoteService.add_computed_fields, document, all_students
+            )
         
         return document
     
     @staticmethod
-    def get_all_notes() -> List[Dict[str, Any]]:
+    def _build_notes_query(
+        semester: str = None,
+        department: str = None,
+        year: str = None
+    ) -> Dict[str, Any]:
+        """
+        Build the MongoDB filter matching get_filtered_notes semantics.
+        
+        Args:
+            semester: Semester code (e.g., "S3"), student must have it
+            department: Department name
+            year: Year string; checked within semester if given, otherwise
+                  any semester of the student may match
+        
+        Returns:
+            MongoDB query document
+        """
+        query: Dict[str, Any] = {}
+        if department is not None:
+            query["department"] = department
+        if semester is not None:
+            if year is not None:
+                query[f"{semester}.year"] = year
+            else:
+                query[semester] = {"$exists": True}
+        elif year is not None:
+            # Semester keys are dynamic (S1, S2, ...), so scan the top-level fields
+            query["$expr"] = {
+                "$anyElementTrue": [{
+                    "$map": {
+                        "input": {"$objectToArray": "$$ROOT"},
+                        "as": "kv",
+                        "in": {"$eq": ["$$kv.v.year", year]}
+                    }
+                }]
+            }
+        return query
+    
+    @staticmethod
+    async def get_all_notes() -> List[Dict[str, Any]]:
         """
         Get all student notes.
         Includes computed fields: moyenne_generale_allsemestre, rang_generall_allsemestre, rang_allsemestre_dep.
+        Results are cached for a short time (see _query_cache).
         
         Returns:
             List of all student notes documents with computed fields
         """
-        documents = list(notes_collection.find())
-        # Convert _id (matricule) to string for JSON serialization
-        for doc in documents:
-            doc["_id"] = str(doc["_id"])
+        return await NoteService._cached(("notes", None, None, None), NoteService._get_all_notes)
+    
+    @staticmethod
+    async def _get_all_notes() -> List[Dict[str, Any]]:
+        """Uncached implementation of get_all_notes"""
+        # _id (matricule) is converted to string for JSON serialization
+        documents = await NoteService._find_all_students()
         
         # Add computed fields to all documents
-        for doc in documents:
-            NoteService.add_computed_fields(doc, documents)
+        await run_in_threadpool(NoteService._add_computed_fields_to_all, documents, documents)
         
         return documents
     
     @staticmethod
-    def get_filtered_notes(
+    async def get_filtered_notes(
         semester: str = None,
         department: str = None,
         year: str = None
@@ -735,56 +974,36 @@ class NoteService:
         Returns:
             List of filtered student notes documents
         """
-        # Get all documents
-        documents = list(notes_collection.find())
-        filtered_docs = []
-        
-        for doc in documents:
-            # Filter by department
-            if department is not None:
-                if doc.get("department") != department:
-                    continue
-            
-            # Filter by semester and/or year
-            if semester is not None or year is not None:
-                # Check if the document has the specified semester
-                if semester is not None and semester not in doc:
-                    continue
-                
-                # If semester is specified, check year within that semester
-                if semester is not None:
-                    semester_data = doc.get(semester, {})
-                    if year is not None:
-                        if semester_data.get("year") != year:
-                            continue
-                else:
-                    # If only year is specified, check all semesters
-                    if year is not None:
-                        found_year = False
-                        for key, value in doc.items():
-                            if isinstance(value, dict) and value.get("year") == year:
-                                found_year = True
-                                break
-                        if not found_year:
-                            continue
-            
+        return await NoteService._cached(
+            ("notes", semester, department, year),
+            lambda: NoteService._get_filtered_notes(semester, department, year)
+        )
+    
+    @staticmethod
+    async def _get_filtered_notes(
+        semester: str = None,
+        department: str = None,
+        year: str = None
+    ) -> List[Dict[str, Any]]:
+        """Uncached implementation of get_filtered_notes"""
+        # Filtering happens in MongoDB (see _build_notes_query)
+        filtered_docs = await async_notes_collection.find(
+            NoteService._build_notes_query(semester, department, year)
+        ).to_list(None)
+        for doc in filtered_docs:
             # Convert _id (matricule) to string for JSON serialization
             doc["_id"] = str(doc["_id"])
-            filtered_docs.append(doc)
         
         # Add computed fields to filtered documents
-        # Get all students for rank calculation
-        all_students = list(notes_collection.find())
-        for s in all_students:
-            s["_id"] = str(s["_id"])
+        # Get all students for rank calculation (identity fields aren't needed)
+        all_students = await NoteService._find_rank_inputs()
         
-        for doc in filtered_docs:
-            NoteService.add_computed_fields(doc, all_students)
+        await run_in_threadpool(NoteService._add_computed_fields_to_all, filtered_docs, all_students)
         
         return filtered_docs
     
     @staticmethod
-    def get_statistics(
+    async def get_statistics(
         semester: str = None,
         department: str = None,
         year: str = None
@@ -800,10 +1019,145 @@ class NoteService:
         Returns:
             Dictionary containing statistics
         """
-        # Get filtered notes
-        notes = NoteService.get_filtered_notes(semester, department, year)
+        return await NoteService._cached(
+            ("statistics", semester, department, year),
+            lambda: NoteService._get_statistics(semester, department, year)
+        )
+    
+    @staticmethod
+    async def _get_statistics(
+        semester: str = None,
+        department: str = None,
+        year: str = None
+    ) -> Dict[str, Any]:
+        """
+        Uncached implementation of get_statistics.
+        Filtering and counting run inside MongoDB as a single aggregation,
+        so documents are never transferred to or looped over in Python.
+        """
+        # Semester data used for each student: the requested semester,
+        # otherwise the first semester that has a moyenne_generale
+        if semester:
+            semester_data_expr = f"${semester}"
+        else:
+            semester_data_expr = {
+                "$let": {
+                    "vars": {
+                        "semesters": {
+                            "$filter": {
+                                "input": {"$objectToArray": "$$ROOT"},
+                                "as": "kv",
+                                "cond": {
+                                    "$and": [
+                                        {"$eq": [{"$type": "$$kv.v"}, "object"]},
+                                        {"$ne": [{"$type": "$$kv.v.moyenne_generale"}, "missing"]}
+                                    ]
+                                }
+                            }
+                        }
+                    },
+                    "in": {"$arrayElemAt": ["$$semesters.v", 0]}
+                }
+            }
         
-        if not notes:
+        pipeline = [
+            {"$match": NoteService._build_notes_query(semester, department, year)},
+            {"$project": {"_id": 0, "sd": semester_data_expr}},
+            {"$project": {
+                "has_data": {
+                    "$and": [
+                        {"$eq": [{"$type": "$sd"}, "object"]},
+                        {"$ne": ["$sd", {}]}
+                    ]
+                },
+                # moyenne_generale as a number ("11,01" -> 11.01, invalid -> 0)
+                "moyenne": {
+                    "$let": {
+                        "vars": {"raw": {"$ifNull": ["$sd.moyenne_generale", 0]}},
+                        "in": {
+                            "$convert": {
+                                "input": {
+                                    "$cond": [
+                                        {"$eq": [{"$type": "$$raw"}, "string"]},
+                                        {"$replaceAll": {"input": "$$raw", "find": ",", "replacement": "."}},
+                                        "$$raw"
+                                    ]
+                                },
+                                "to": "double",
+                                "onError": 0.0,
+                                "onNull": 0.0
+                            }
+                        }
+                    }
+                },
+                "decision": {
+                    "$let": {
+                        "vars": {"raw": {"$ifNull": ["$sd.decision", ""]}},
+                        "in": {
+                            "$cond": [
+                                {"$in": ["$$raw", ["", 0, False]]},
+                                "",
+                                {"$toUpper": {"$toString": "$$raw"}}
+                            ]
+                        }
+                    }
+                },
+                "credit_total": {"$ifNull": ["$sd.credit_total", 0]}
+            }},
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "status": [
+                    {"$match": {"has_data": True}},
+                    {"$group": {
+                        "_id": {
+                            "$switch": {
+                                "branches": [
+                                    {
+                                        "case": {"$or": [
+                                            {"$gte": [{"$indexOfCP": ["$decision", "ADMIS"]}, 0]},
+                                            {"$and": [
+                                                {"$gte": ["$moyenne", 10]},
+                                                {"$gte": ["$credit_total", 30]}
+                                            ]}
+                                        ]},
+                                        "then": "passed"
+                                    },
+                                    {
+                                        "case": {"$or": [
+                                            {"$gte": [{"$indexOfCP": ["$decision", "RATTRAPAGE"]}, 0]},
+                                            {"$and": [
+                                                {"$lt": ["$moyenne", 10]},
+                                                {"$lt": ["$credit_total", 30]}
+                                            ]}
+                                        ]},
+                                        "then": "rattrapage"
+                                    }
+                                ],
+                                "default": "failed"
+                            }
+                        },
+                        "count": {"$sum": 1}
+                    }}
+                ],
+                # Distribution of averages rounded to the nearest integer, clamped to 0-20
+                "distribution": [
+                    {"$match": {"has_data": True, "moyenne": {"$gte": 0}}},
+                    {"$group": {
+                        "_id": {"$max": [0, {"$min": [20, {"$round": ["$moyenne", 0]}]}]},
+                        "count": {"$sum": 1},
+                        "sum": {"$sum": "$moyenne"}
+                    }}
+                ]
+            }}
+        ]
+        
+        cursor = await async_notes_collection.aggregate(pipeline)
+        results = await cursor.to_list(1)
+        result = results[0] if results else {}
+        total = result.get("total") or [{"count": 0}]
+        total_students = total[0]["count"]
+        
+        if not total_students:
             return {
                 "total_students": 0,
                 "passed": 0,
@@ -816,70 +1170,19 @@ class NoteService:
                 "total_average": 0.0
             }
         
-        total_students = len(notes)
-        passed = 0
-        failed = 0
-        rattrapage = 0
-        total_average_sum = 0.0
-        average_count = 0
+        status_counts = {group["_id"]: group["count"] for group in result.get("status", [])}
+        passed = status_counts.get("passed", 0)
+        failed = status_counts.get("failed", 0)
+        rattrapage = status_counts.get("rattrapage", 0)
         
         # توزيع المعدلات لكل رقم من 0 إلى 20
-        average_distribution_dict = {str(i): 0 for i in range(21)}  # 0 إلى 20
-        
-        for note in notes:
-            # تحديد البيانات حسب semester
-            semester_data = None
-            if semester:
-                semester_data = note.get(semester, {})
-            else:
-                # إذا لم يتم تحديد semester، نأخذ أول semester موجود
-                for key, value in note.items():
-                    if isinstance(value, dict) and "moyenne_generale" in value:
-                        semester_data = value
-                        break
-            
-            if not semester_data:
-                continue
-            
-            # الحصول على المعدل العام
-            moyenne_generale = semester_data.get("moyenne_generale", 0)
-            decision = semester_data.get("decision", "")
-            credit_total = semester_data.get("credit_total", 0)
-            
-            # تحويل المعدل إلى رقم
-            try:
-                if isinstance(moyenne_generale, str):
-                    moyenne_generale = float(moyenne_generale.replace(',', '.'))
-                else:
-                    moyenne_generale = float(moyenne_generale)
-            except:
-                moyenne_generale = 0.0
-            
-            # حساب المعدل في التوزيع (تقريب إلى أقرب رقم صحيح)
-            if moyenne_generale >= 0:
-                # تقريب المعدل إلى أقرب رقم صحيح
-                moyenne_rounded = int(round(moyenne_generale))
-                # التأكد من أن المعدل بين 0 و 20
-                moyenne_rounded = max(0, min(20, moyenne_rounded))
-                
-                total_average_sum += moyenne_generale
-                average_count += 1
-                
-                # إضافة إلى التوزيع
-                average_distribution_dict[str(moyenne_rounded)] += 1
-            
-            # تحديد النجاح/الرسوب/الدورة
-            decision_upper = str(decision).upper() if decision else ""
-            
-            # الناجحون: decision يحتوي على "ADMIS" أو المعدل >= 10 و credit_total >= 30
-            if "ADMIS" in decision_upper or (moyenne_generale >= 10 and credit_total >= 30):
-                passed += 1
-            # الدورة: decision يحتوي على "RATTRAPAGE" أو المعدل < 10 و credit_total < 30
-            elif "RATTRAPAGE" in decision_upper or (moyenne_generale < 10 and credit_total < 30):
-                rattrapage += 1
-            # الراسبون: الباقي
-            else:
-                failed += 1
+        average_distribution_dict = {i: 0 for i in range(21)}
+        total_average_sum = 0.0
+        average_count = 0
+        for bucket in result.get("distribution", []):
+            average_distribution_dict[int(bucket["_id"])] += bucket["count"]
+            total_average_sum += bucket["sum"]
+            average_count += bucket["count"]
         
         # حساب النسب المئوية
         passed_percentage = (passed / total_students * 100) if total_students > 0 else 0.0
@@ -890,7 +1193,7 @@ class NoteService:
         # تحويل التوزيع إلى قائمة مع النسب (لكل رقم من 0 إلى 20)
         average_distribution = []
         for i in range(21):  # من 0 إلى 20
-            count = average_distribution_dict[str(i)]
+            count = average_distribution_dict[i]
             percentage = (count / average_count * 100) if average_count > 0 else 0.0
             average_distribution.append({
                 "average": i,
@@ -937,6 +1240,8 @@ class NoteService:
             }
         )
         
+        NoteService.clear_cache()
+        
         return {
             "semester": semester,
             "year": year,
@@ -945,7 +1250,7 @@ class NoteService:
         }
     
     @staticmethod
-    def update_semester_ispublic(matricule: int, semester: str, is_public: bool) -> Dict[str, Any]:
+    async def update_semester_ispublic(matricule: int, semester: str, is_public: bool) -> Dict[str, Any]:
         """
         Update isPublic field for a specific semester of a student.
         
@@ -958,7 +1263,7 @@ class NoteService:
             Dictionary with operation result
         """
         # Check if student document exists
-        student_doc = notes_collection.find_one({"_id": matricule})
+        student_doc = await async_notes_collection.find_one({"_id": matricule}, {semester: 1})
         if not student_doc:
             raise ValueError(f"Student with matricule {matricule} not found")
         
@@ -967,7 +1272,7 @@ class NoteService:
             raise ValueError(f"Semester {semester} not found for student {matricule}")
         
         # Update isPublic field using dot notation
-        result = notes_collection.update_one(
+        result = await async_notes_collection.update_one(
             {"_id": matricule},
             {
                 "$set": {
@@ -980,6 +1285,8 @@ class NoteService:
         if result.matched_count == 0:
             raise ValueError(f"Failed to update semester {semester} for student {matricule}")
         
+        NoteService.clear_cache()
+        
         return {
             "matricule": matricule,
             "semester": semester,
@@ -988,7 +1295,7 @@ class NoteService:
         }
     
     @staticmethod
-    def update_ispublic_globale(matricule: int, is_public_globale: bool) -> Dict[str, Any]:
+    async def update_ispublic_globale(matricule: int, is_public_globale: bool) -> Dict[str, Any]:
         """
         Update isPublicGlobale field for a student.
         
@@ -1000,12 +1307,12 @@ class NoteService:
             Dictionary with operation result
         """
         # Check if student document exists
-        student_doc = notes_collection.find_one({"_id": matricule})
+        student_doc = await async_notes_collection.find_one({"_id": matricule}, {"_id": 1})
         if not student_doc:
             raise ValueError(f"Student with matricule {matricule} not found")
         
         # Update isPublicGlobale field
-        result = notes_collection.update_one(
+        result = await async_notes_collection.update_one(
             {"_id": matricule},
             {
                 "$set": {
@@ -1018,6 +1325,8 @@ class NoteService:
         if result.matched_count == 0:
             raise ValueError(f"Failed to update isPublicGlobale for student {matricule}")
         
+        NoteService.clear_cache()
+        
         return {
             "matricule": matricule,
             "isPublicGlobale": is_public_globale,
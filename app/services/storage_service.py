@@ -2,10 +2,12 @@
 Storage service for handling file uploads.
 Supports both local storage and AWS S3 cloud storage.
 """
+import io
 import os
+import shutil
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Optional, BinaryIO, Union, Callable, Tuple, TypeVar
 from app.core.config import settings
 
 # Storage type: "local" or "s3"
@@ -13,12 +15,55 @@ STORAGE_TYPE = settings.STORAGE_TYPE.lower()
 
 # Local storage directory
 UPLOADS_DIR = "uploads/csv"
+
+# Chunk size used when copying uploaded file objects to disk
+COPY_CHUNK_SIZE = 1024 * 1024
 if STORAGE_TYPE == "local":
     os.makedirs(UPLOADS_DIR, exist_ok=True)
 
 # S3 client (lazy import)
 _s3_client = None
 
+T = TypeVar("T")
+
+
+class _TeeReader(io.RawIOBase):
+    """
+    Raw reader returning data from source and copying every chunk into sink.
+    Can be rewound to the start (if source is seekable), which restarts the copy.
+    """
+    
+    def __init__(self, source: BinaryIO, sink: BinaryIO):
+        self._source = source
+        self._sink = sink
+        self._start = source.tell() if source.seekable() else None
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return self._start is not None
+    
+    def tell(self) -> int:
+        if self._start is None:
+            raise io.UnsupportedOperation("source is not seekable")
+        return self._source.tell() - self._start
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if self._start is None or offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("can only rewind to the start")
+        self._source.seek(self._start)
+        self._sink.seek(0)
+        self._sink.truncate()
+        return 0
+    
+    def readinto(self, buffer) -> int:
+        data = self._source.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        self._sink.write(data)
+        return size
+
 
 def get_s3_client():
     """Get or create S3 client (lazy initialization)"""
@@ -62,12 +107,13 @@ def generate_unique_filename(original_filename: str) -> str:
     return filename
 
 
-def save_file(file_content: bytes, original_filename: str) -> str:
+def save_file(file_content: Union[bytes, BinaryIO], original_filename: str) -> str:
     """
     Save file to storage (local or S3) and return the saved path/key
     
     Args:
-        file_content: File content as bytes
+        file_content: File content as bytes, or a binary file object
+                      (copied in chunks from its current position)
         original_filename: Original filename
     
     Returns:
@@ -79,7 +125,10 @@ def save_file(file_content: bytes, original_filename: str) -> str:
         # Local storage
         file_path = os.path.join(UPLOADS_DIR, filename)
         with open(file_path, "wb") as f:
-            f.write(file_content)
+            if isinstance(file_content, (bytes, bytearray)):
+                f.write(file_content)
+            else:
+                shutil.copyfileobj(file_content, f, COPY_CHUNK_SIZE)
         return file_path
     
     elif STORAGE_TYPE == "s3":
@@ -105,6 +154,44 @@ def save_file(file_content: bytes, original_filename: str) -> str:
         raise ValueError(f"Unknown storage type: {STORAGE_TYPE}")
 
 
+def save_file_while_reading(
+    file_content: BinaryIO,
+    original_filename: str,
+    reader: Callable[[BinaryIO], T]
+) -> Tuple[T, str]:
+    """
+    Save file to storage while reader consumes it.
+    With local storage the data is traversed once: every chunk the reader
+    pulls is written to disk as it goes. The file is removed if reader fails.
+    S3 needs the complete body, so there the file is read, rewound and uploaded.
+    
+    Args:
+        file_content: Binary file object, read from its current position
+        original_filename: Original filename
+        reader: Function consuming a binary file object (e.g., a parser)
+    
+    Returns:
+        Tuple of (reader result, saved file path or S3 key)
+    """
+    if STORAGE_TYPE != "local":
+        start = file_content.tell()
+        result = reader(file_content)
+        file_content.seek(start)
+        return result, save_file(file_content, original_filename)
+    
+    file_path = os.path.join(UPLOADS_DIR, generate_unique_filename(original_filename))
+    try:
+        with open(file_path, "wb") as f:
+            result = reader(io.BufferedReader(_TeeReader(file_content, f), COPY_CHUNK_SIZE))
+            # Copy anything the reader didn't consume
+            shutil.copyfileobj(file_content, f, COPY_CHUNK_SIZE)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return result, file_path
+
+
 def delete_file(file_path_or_key: str) -> bool:
     """
     Delete a file from storage
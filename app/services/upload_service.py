@@ -1,36 +1,87 @@
+import asyncio
+import hashlib
 import os
+import threading
 import uuid
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, BinaryIO, Union, Tuple, Callable, Awaitable
 from bson import ObjectId
-from app.db.mongo import db, users_collection
+from cachetools import TTLCache
+from app.db.mongo import db, async_db, users_collection, notes_collection, async_notes_collection
+from app.services.csv_service import CSVService
 from app.services.storage_service import (
     save_file,
+    save_file_while_reading,
     delete_file,
     generate_unique_filename
 )
 
 # Get CSV uploads collection
 csv_uploads_collection = db.csv_uploads
+async_csv_uploads_collection = async_db.csv_uploads
+
+# Read size used when hashing uploaded files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Emails looked up by user ID (a user's email never changes once registered)
+_user_email_cache = TTLCache(maxsize=1024, ttl=300)
+_user_email_cache_lock = threading.Lock()
+
+# Dashboard stats and the full uploads list, cached briefly so a burst of
+# admin page loads runs the queries once. Cleared when uploads or notes change.
+_uploads_cache = TTLCache(maxsize=8, ttl=10)
+_uploads_cache_lock = threading.Lock()
+_uploads_compute_lock = asyncio.Lock()
+
+
+async def _cached_uploads_read(key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+    """Return cached result for key; concurrent misses share one computation"""
+    with _uploads_cache_lock:
+        if key in _uploads_cache:
+            return _uploads_cache[key]
+    async with _uploads_compute_lock:
+        with _uploads_cache_lock:
+            if key in _uploads_cache:
+                return _uploads_cache[key]
+        result = await compute()
+        with _uploads_cache_lock:
+            _uploads_cache[key] = result
+        return result
+
+
+def clear_uploads_cache() -> None:
+    """Invalidate cached dashboard stats and uploads list"""
+    with _uploads_cache_lock:
+        _uploads_cache.clear()
 
 
 def get_user_email(user_id: str) -> Optional[str]:
-    """Get user email from user ID"""
+    """Get user email from user ID (cached for a few minutes)"""
+    with _user_email_cache_lock:
+        email = _user_email_cache.get(user_id)
+    if email is not None:
+        return email
+    
     try:
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
+        user = users_collection.find_one({"_id": ObjectId(user_id)}, {"email": 1})
         if user:
-            return user.get("email")
-        return None
+            email = user.get("email")
     except Exception:
         return None
+    
+    # Misses aren't cached so a user created afterwards is found right away
+    if email is not None:
+        with _user_email_cache_lock:
+            _user_email_cache[user_id] = email
+    return email
 
 
-def save_csv_file(file_content: bytes, original_filename: str) -> str:
+def save_csv_file(file_content: Union[bytes, BinaryIO], original_filename: str) -> str:
     """
     Save CSV file to storage (local or S3) and return the saved path/key
     
     Args:
-        file_content: File content as bytes
+        file_content: File content as bytes, or a binary file object
         original_filename: Original filename
     
     Returns:
@@ -39,6 +90,86 @@ def save_csv_file(file_content: bytes, original_filename: str) -> str:
     return save_file(file_content, original_filename)
 
 
+def process_and_save_csv_file(
+    file_content: BinaryIO,
+    original_filename: str,
+    year: str
+) -> Tuple[Dict[int, Any], str, str]:
+    """
+    Parse a CSV upload and save it to storage in a single pass over the data.
+    Nothing is kept in storage if parsing fails.
+    
+    Args:
+        file_content: Binary file object positioned at the start of the CSV
+        original_filename: Original filename
+        year: Year string in format "YYYY-YYYY" (e.g., "2024-2025")
+    
+    Returns:
+        Tuple of (students data keyed by matricule, semester, saved path/key)
+    """
+    (students_data, semester), saved_path = save_file_while_reading(
+        file_content,
+        original_filename,
+        lambda f: CSVService.process_csv_file(f, year)
+    )
+    return students_data, semester, saved_path
+
+
+def compute_content_hash(file_content: BinaryIO) -> str:
+    """
+    Compute the BLAKE2b hash of a file object's content, read in chunks.
+    The file position is restored afterwards.
+    
+    Args:
+        file_content: Binary file object
+    
+    Returns:
+        Hex digest of the content from the current position to the end
+    """
+    start = file_content.tell()
+    hasher = hashlib.blake2b(digest_size=32)
+    while chunk := file_content.read(HASH_CHUNK_SIZE):
+        hasher.update(chunk)
+    file_content.seek(start)
+    return hasher.hexdigest()
+
+
+def find_duplicate_upload(content_hash: str, year: str) -> Optional[Dict[str, Any]]:
+    """
+    Find a previous upload of the same file content for the same year
+    that is still what's stored: it must be the most recent upload of its
+    semester and year (a later upload may have overwritten its notes), and
+    its notes must still be there (they may have been removed since by
+    deleting another upload of the same semester and year).
+    
+    Args:
+        content_hash: Hash from compute_content_hash
+        year: Year string (e.g., "2024-2025")
+    
+    Returns:
+        Existing upload document or None
+    """
+    upload = csv_uploads_collection.find_one(
+        {"content_hash": content_hash, "year": year},
+        {"semester": 1}
+    )
+    if not upload:
+        return None
+    
+    semester = upload.get("semester")
+    latest = csv_uploads_collection.find_one(
+        {"semester": semester, "year": year},
+        sort=[("uploaded_at", -1)]
+    )
+    if not latest or latest.get("content_hash") != content_hash:
+        return None
+    
+    stored_notes = notes_collection.count_documents({f"{semester}.year": year})
+    if stored_notes < latest.get("students_count", 0):
+        return None
+    return latest
+
+
 def delete_csv_file(file_path_or_key: str) -> bool:
     """
     Delete a CSV file from storage
@@ -60,7 +191,8 @@ def save_upload_info(
     year: str,
     semester: str,
     students_count: int,
-    file_size: int
+    file_size: int,
+    content_hash: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Save CSV upload information to MongoDB
@@ -74,6 +206,7 @@ def save_upload_info(
         semester: Semester string (e.g., "S3")
         students_count: Number of students processed
         file_size: File size in bytes
+        content_hash: Hash of the file content (used to detect re-uploads)
     
     Returns:
         Saved document
@@ -87,22 +220,28 @@ def save_upload_info(
         "year": year,
         "semester": semester,
         "students_count": students_count,
-        "file_size": file_size
+        "file_size": file_size,
+        "content_hash": content_hash
     }
     
     result = csv_uploads_collection.insert_one(upload_info)
     upload_info["_id"] = result.inserted_id
+    clear_uploads_cache()
     return upload_info
 
 
-def get_all_uploads() -> List[Dict[str, Any]]:
+async def get_all_uploads() -> List[Dict[str, Any]]:
     """
-    Get all CSV uploads from database
+    Get all CSV uploads from database (cached for a few seconds)
     
     Returns:
         List of all upload documents
     """
-    uploads = list(csv_uploads_collection.find().sort("uploaded_at", -1))
+    return await _cached_uploads_read("all_uploads", _get_all_uploads)
+
+
+async def _get_all_uploads() -> List[Dict[str, Any]]:
+    uploads = await async_csv_uploads_collection.find().sort("uploaded_at", -1).to_list(None)
     # Convert ObjectId to string for JSON serialization
     for upload in uploads:
         upload["_id"] = str(upload["_id"])
@@ -112,24 +251,28 @@ def get_all_uploads() -> List[Dict[str, Any]]:
     return uploads
 
 
-def get_uploads_by_date_range(start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+async def get_uploads_by_date_range(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime]
+) -> List[Dict[str, Any]]:
     """
     Get CSV uploads filtered by date range
     
     Args:
-        start_date: Start date (inclusive)
-        end_date: End date (inclusive)
+        start_date: Start date (inclusive), or None for no lower bound
+        end_date: End date (inclusive), or None for no upper bound
     
     Returns:
         List of upload documents in the date range
     """
-    query = {
-        "uploaded_at": {
-            "$gte": start_date,
-            "$lte": end_date
-        }
-    }
-    uploads = list(csv_uploads_collection.find(query).sort("uploaded_at", -1))
+    # Only the bounds that were given go into the filter
+    uploaded_at: Dict[str, datetime] = {}
+    if start_date is not None:
+        uploaded_at["$gte"] = start_date
+    if end_date is not None:
+        uploaded_at["$lte"] = end_date
+    query = {"uploaded_at": uploaded_at} if uploaded_at else {}
+    uploads = await async_csv_uploads_collection.find(query).sort("uploaded_at", -1).to_list(None)
     # Convert ObjectId to string for JSON serialization
     for upload in uploads:
         upload["_id"] = str(upload["_id"])
@@ -139,7 +282,7 @@ def get_uploads_by_date_range(start_date: datetime, end_date: datetime) -> List[
     return uploads
 
 
-def get_upload_by_id(upload_id: str) -> Optional[Dict[str, Any]]:
+async def get_upload_by_id(upload_id: str) -> Optional[Dict[str, Any]]:
     """
     Get a specific upload by ID
     
@@ -150,7 +293,7 @@ def get_upload_by_id(upload_id: str) -> Optional[Dict[str, Any]]:
         Upload document or None if not found
     """
     try:
-        upload = csv_uploads_collection.find_one({"_id": ObjectId(upload_id)})
+        upload = await async_csv_uploads_collection.find_one({"_id": ObjectId(upload_id)})
         if upload:
             upload["_id"] = str(upload["_id"])
             upload["uploaded_by"] = str(upload["uploaded_by"])
@@ -166,6 +309,8 @@ def delete_upload(upload_id: str) -> Dict[str, Any]:
     Delete an upload record, its associated file, and all related notes.
     Extracts year and semester from upload info and deletes all notes
     associated with that semester and year.
+    The record is fetched and deleted in one round-trip; it is restored if
+    the notes can't be deleted, so the deletion can be retried.
     
     Args:
         upload_id: Upload document ID
@@ -174,12 +319,13 @@ def delete_upload(upload_id: str) -> Dict[str, Any]:
         Dictionary with deletion results including notes deletion info
     """
     try:
-        upload = csv_uploads_collection.find_one({"_id": ObjectId(upload_id)})
+        upload = csv_uploads_collection.find_one_and_delete({"_id": ObjectId(upload_id)})
         if not upload:
             return {
                 "success": False,
                 "message": "Upload not found"
             }
+        clear_uploads_cache()
         
         # Extract year and semester from upload info
         year = upload.get("year")
@@ -189,21 +335,24 @@ def delete_upload(upload_id: str) -> Dict[str, Any]:
         notes_deletion_result = None
         if year and semester:
             from app.services.note_service import NoteService
-            notes_deletion_result = NoteService.delete_notes_by_semester_and_year(semester, year)
+            try:
+                notes_deletion_result = NoteService.delete_notes_by_semester_and_year(semester, year)
+            except Exception:
+                csv_uploads_collection.insert_one(upload)
+                clear_uploads_cache()
+                raise
         
-        # Delete file from disk
+        # Delete file last (storage isn't transactional with the database)
         saved_path = upload.get("saved_path")
         file_deleted = False
         if saved_path:
             file_deleted = delete_csv_file(saved_path)
-        
-        # Delete record from database
-        result = csv_uploads_collection.delete_one({"_id": ObjectId(upload_id)})
-        upload_deleted = result.deleted_count > 0
+            if not file_deleted:
+                print(f"Could not delete uploaded file {saved_path}")
         
         return {
-            "success": upload_deleted,
-            "upload_deleted": upload_deleted,
+            "success": True,
+            "upload_deleted": True,
             "file_deleted": file_deleted,
             "notes_deletion": notes_deletion_result,
             "year": year,
@@ -216,9 +365,9 @@ def delete_upload(upload_id: str) -> Dict[str, Any]:
         }
 
 
-def get_dashboard_stats() -> Dict[str, Any]:
+async def get_dashboard_stats() -> Dict[str, Any]:
     """
-    Get dashboard statistics for the main page
+    Get dashboard statistics for the main page (cached for a few seconds)
     
     Returns:
         Dictionary containing:
@@ -227,18 +376,20 @@ def get_dashboard_stats() -> Dict[str, Any]:
         - last_upload: Information about the last uploaded file
         - recent_uploads: List of recent uploads (last 5)
     """
-    from app.db.mongo import notes_collection
-    
-    # Get total uploads count
-    total_uploads = csv_uploads_collection.count_documents({})
-    
-    # Get total students count
-    total_students = notes_collection.count_documents({})
+    return await _cached_uploads_read("dashboard", _get_dashboard_stats)
+
+
+async def _get_dashboard_stats() -> Dict[str, Any]:
+    # Run the independent queries concurrently: total uploads, total
+    # students and recent uploads (last 5, the first being the last upload)
+    total_uploads, total_students, recent_uploads_docs = await asyncio.gather(
+        async_csv_uploads_collection.count_documents({}),
+        async_notes_collection.count_documents({}),
+        async_csv_uploads_collection.find().sort("uploaded_at", -1).limit(5).to_list(None)
+    )
     
     # Get last upload
-    last_upload_doc = csv_uploads_collection.find_one(
-        sort=[("uploaded_at", -1)]
-    )
+    last_upload_doc = recent_uploads_docs[0] if recent_uploads_docs else None
     last_upload = None
     if last_upload_doc:
         last_upload = {
@@ -252,7 +403,6 @@ def get_dashboard_stats() -> Dict[str, Any]:
         }
     
     # Get recent uploads (last 5)
-    recent_uploads_docs = list(csv_uploads_collection.find().sort("uploaded_at", -1).limit(5))
     recent_uploads = []
     for upload in recent_uploads_docs:
         recent_uploads.append({